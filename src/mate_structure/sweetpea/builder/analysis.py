@@ -0,0 +1,319 @@
+from __future__ import annotations
+import warnings
+from dataclasses import dataclass, field
+from itertools import product
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from mate_structure.sweetpea.builder.expr import Ref, parse_expr
+from mate_structure.sweetpea.utils.audit import feasible_cells
+from mate_structure.sweetpea.utils.convert import dependency_waves, is_regular
+from mate_structure.sweetpea.utils.convert.lookup import MAX_CELLS
+
+EXAMPLES = 3                                # offending combinations kept per factor
+
+
+# --------------------------------------------------------------------
+# derived factors: every parent combination matches exactly one level
+# --------------------------------------------------------------------
+@dataclass
+class FactorAnalysis:
+    """
+    Level coverage of one derived factor.
+
+    parents:      every ``(factor, offset)`` its levels read
+    width:        window width, through derived parents (1: within trial)
+    combinations: parent-level combinations checked (0: too many to check)
+    gaps:         combinations no level matches (the first few)
+    overlaps:     combinations several levels match, with those levels
+    """
+    name: str
+    parents: Tuple[Ref, ...]
+    width: int
+    combinations: int = 0
+    n_gaps: int = 0
+    n_overlaps: int = 0
+    gaps: List[tuple] = field(default_factory=list)
+    overlaps: List[tuple] = field(default_factory=list)
+
+    @property
+    def exhaustive(self) -> bool:
+        return self.combinations > 0 and self.n_gaps == 0
+
+    @property
+    def exclusive(self) -> bool:
+        return self.combinations > 0 and self.n_overlaps == 0
+
+
+def _check_levels(f: dict, parents: Tuple[Ref, ...], domains: Dict[str, List[str]],
+                  result: FactorAnalysis, max_combinations: int) -> None:
+    """Evaluate every level of *f* on every combination of its parents' levels."""
+    sizes = [len(domains[name]) for name, _ in parents]
+    n = int(np.prod(sizes, dtype=np.float64))
+    if n > max_combinations:
+        return
+    calls = []
+    for lv in f["levels"]:
+        ir = parse_expr(lv["expr"])
+        calls.append((lv["name"], ir.fn, [parents.index(ref) for ref in ir.refs]))
+
+    for combo in product(*(domains[name] for name, _ in parents)):
+        hits = [name for name, fn, at in calls if fn(*(combo[i] for i in at))]
+        if not hits:
+            result.n_gaps += 1
+            if len(result.gaps) < EXAMPLES:
+                result.gaps.append(combo)
+        elif len(hits) > 1:
+            result.n_overlaps += 1
+            if len(result.overlaps) < EXAMPLES:
+                result.overlaps.append((combo, tuple(hits)))
+    result.combinations = n
+
+
+# --------------------------------------------------------------------
+# crossings: weighted size and trial count, as SweetPea counts them
+# --------------------------------------------------------------------
+@dataclass
+class CrossingAnalysis:
+    """
+    Size of one crossing block.
+
+    full:     product of the factors' level weight sums
+    excluded: summed weight of the combinations derived levels rule out
+    size:     ``full - excluded``, the trials of one pass of the crossing
+    trials:   trials that pass needs, with the window preamble
+    """
+    factors: Tuple[str, ...]
+    full: int
+    excluded: int
+    size: int
+    trials: int
+
+
+def _weight_sums(f: dict) -> int:
+    return sum(lv.get("weight") or 1 for lv in f["levels"])
+
+
+def _cell_weights(factors: List[dict]) -> np.ndarray:
+    weights = np.ones(1, dtype=np.int64)
+    for f in factors:
+        w = [lv.get("weight") or 1 for lv in f["levels"]]
+        weights = np.multiply.outer(weights, np.array(w, dtype=np.int64)).ravel()
+    return weights
+
+
+# --------------------------------------------------------------------
+# whole design
+# --------------------------------------------------------------------
+@dataclass
+class DesignAnalysis:
+    """
+    Static analysis of a design – no SweetPea objects are built.
+
+    factors:      one :class:`FactorAnalysis` per derived factor
+    crossings:    one :class:`CrossingAnalysis` per crossing block
+    trials:       trials per sequence, ``max(minimum_trials, crossings)``
+    window_depth: widest window of any factor (1: no windows)
+    errors:       problems SweetPea would fail on, or be unable to solve
+    warnings:     problems that restrict the design but may be intended
+    """
+    factors: List[FactorAnalysis]
+    crossings: List[CrossingAnalysis]
+    trials: int
+    window_depth: int
+    errors: List[str]
+    warnings: List[str]
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+
+def analyze_design(
+    data: dict,
+    minimum_trials: int = 1,
+    *,
+    max_trials: int | None = None,
+    max_combinations: int = MAX_CELLS,
+) -> DesignAnalysis:
+    """
+    Analyse the *ExperimentSchema* dict *data* before any solver work.
+
+    Each derived factor is evaluated on every combination of its direct
+    parents' levels (up to *max_combinations*; larger factors are
+    reported as unchecked): a combination matching no level is a gap
+    (a warning – those trials cannot occur), one matching several
+    levels an overlap (an error).  Each crossing block gets its weighted
+    size, minus the combinations the derived levels rule out, and the
+    trials it needs with the preamble of its windows; blocks of a nested
+    crossing must, as in ``MultiCrossBlock``, share their preamble and
+    fill the trials exactly once.  More than *max_trials* trials per
+    sequence is an error.
+
+    Examples:
+        >>> design = {"factors": [
+        ...     {"name": "color", "levels": [{"name": "red"}, {"name": "green"}, {"name": "grey", "weight": 3}]},
+        ...     {"name": "word", "levels": [{"name": "red"}, {"name": "green"}]},
+        ...     {"name": "con", "levels": [{"name": "yes", "expr": "color==word"},
+        ...                                {"name": "no", "expr": "color!=word and color!='grey'"}]},
+        ...     {"name": "rep", "levels": [{"name": "y", "expr": "word[-1]==word[0]"},
+        ...                                {"name": "n", "expr": "word[-1]!=word[0]"}]}],
+        ...     "crossing": [["color", "word"], ["con", "rep"]]}
+        >>> a = analyze_design(design)
+        >>> [(c.factors, c.full, c.excluded, c.size, c.trials) for c in a.crossings]
+        [(('color', 'word'), 10, 0, 10, 10), (('con', 'rep'), 4, 0, 4, 5)]
+        >>> a.trials, a.window_depth
+        (10, 2)
+        >>> a.warnings
+        ["Factor 'con' has no level for 2 of 6 parent combinations, e.g. color='grey', word='red'"]
+        >>> for error in a.errors: print(error)
+        Crossing color, word needs 2 combinations no trial can have, e.g. color='grey', word='red'
+        Crossing blocks need different window preambles (0, 1 trials)
+        Crossing con, rep has 4 combinations, which do not fill 10 trials exactly once
+
+        Derived levels are weighted like regular ones:
+
+        >>> analyze_design({"factors": [
+        ...     {"name": "color", "levels": [{"name": "red"}, {"name": "blue", "weight": 2}]},
+        ...     {"name": "word", "levels": [{"name": "red"}, {"name": "blue"}]},
+        ...     {"name": "con", "levels": [{"name": "yes", "expr": "color==word", "weight": 3},
+        ...                                {"name": "no", "expr": "color!=word"}]}],
+        ...     "crossing": [["color", "con"]]}).trials
+        12
+    """
+    factors = data.get("factors") or []
+    crossing = data.get("crossing") or []
+    errors: List[str] = []
+    notes: List[str] = []
+    if not factors:
+        errors.append("Factors cannot be None")
+    if not crossing:
+        errors.append("Crossing cannot be None")
+    by_name = {f["name"]: f for f in factors}
+    if len(by_name) != len(factors):
+        errors.append("Duplicate factor names")
+
+    domains = {f["name"]: [lv["name"] for lv in f["levels"]] for f in factors}
+    for f in factors:
+        if len(set(domains[f["name"]])) != len(domains[f["name"]]):
+            errors.append(f"Factor {f['name']!r} has duplicate level names")
+        if not is_regular(f) and not all("expr" in lv for lv in f["levels"]):
+            errors.append(f"Factor {f['name']!r} mixes regular and derived levels")
+
+    # ---------- derived factors, parents first -----------------------
+    widths: Dict[str, int] = {}
+    analysed: List[FactorAnalysis] = []
+    try:
+        order = [n for wave in dependency_waves(factors) for n in wave]
+    except ValueError as err:
+        errors.append(str(err))
+        order = []
+    for name in order:
+        f = by_name[name]
+        if is_regular(f):
+            widths[name] = 1
+            continue
+        try:
+            parents = tuple(dict.fromkeys(ref for lv in f["levels"] if "expr" in lv
+                                          for ref in parse_expr(lv["expr"]).refs))
+        except ValueError as err:
+            errors.append(f"Factor {name!r}: {err}")
+            continue
+        unknown = sorted({p for p, _ in parents if p not in by_name})
+        if unknown:
+            errors.append(f"Factor {name!r} references unknown factors: {', '.join(unknown)}")
+            continue
+        if any(k > 0 for _, k in parents):
+            errors.append(f"Factor {name!r} references a later trial")
+            continue
+        widths[name] = max(widths.get(p, 1) - k for p, k in parents)
+        result = FactorAnalysis(name, parents, widths[name])
+        analysed.append(result)
+        try:
+            _check_levels(f, parents, domains, result, max_combinations)
+        except Exception as err:
+            errors.append(f"Factor {name!r} cannot be evaluated: {type(err).__name__}: {err}")
+            continue
+
+        def shown(combo) -> str:
+            return ", ".join(f"{p}={v!r}" if k == 0 else f"{p}[{k}]={v!r}"
+                             for (p, k), v in zip(parents, combo))
+
+        if not result.combinations:
+            notes.append(f"Factor {name!r} has too many parent combinations to check")
+        if result.n_overlaps:
+            combo, hits = result.overlaps[0]
+            errors.append(f"Factor {name!r} has several levels for {result.n_overlaps} of "
+                          f"{result.combinations} parent combinations, e.g. {shown(combo)} "
+                          f"→ {', '.join(hits)}")
+        if result.n_gaps:
+            notes.append(f"Factor {name!r} has no level for {result.n_gaps} of "
+                         f"{result.combinations} parent combinations, e.g. {shown(result.gaps[0])}")
+
+    # ---------- crossing blocks --------------------------------------
+    blocks = [crossing] if crossing and isinstance(crossing[0], str) else crossing
+    crossings: List[CrossingAnalysis] = []
+    for block in blocks:
+        unknown = [c for c in block if c not in by_name]
+        if unknown:
+            errors.append(f"Crossing references unknown factors: {', '.join(unknown)}")
+            continue
+        if not all(c in widths for c in block):
+            continue                            # factor already reported
+        members = [by_name[c] for c in block]
+        full = int(np.prod([_weight_sums(f) for f in members], dtype=np.int64))
+        mask = feasible_cells(factors, list(block))
+        excluded = int(_cell_weights(members)[~mask].sum())
+        size = full - excluded
+        trials = size + max(widths[c] for c in block) - 1
+        crossings.append(CrossingAnalysis(tuple(block), full, excluded, size, trials))
+        if size == 0:
+            errors.append(f"Crossing {', '.join(block)} has no reachable combination")
+        # cells SweetPea counts but a gap in another derived factor rules out
+        stranded = np.flatnonzero(mask & ~feasible_cells(factors, list(block), complete=True))
+        if len(stranded):
+            cell = np.unravel_index(stranded[0], [len(f["levels"]) for f in members])
+            shown = ", ".join(f"{c}={domains[c][i]!r}" for c, i in zip(block, cell))
+            errors.append(f"Crossing {', '.join(block)} needs {len(stranded)} combinations "
+                          f"no trial can have, e.g. {shown}")
+        elif excluded:
+            notes.append(f"Crossing {', '.join(block)} is incomplete: derived levels rule "
+                         f"out {excluded} of {full} weighted combinations")
+
+    trials = max([minimum_trials] + [c.trials for c in crossings])
+    if crossing and not isinstance(crossing[0], str) and len(crossings) == len(blocks):
+        # MultiCrossBlock: equal preambles, each block filling the trials once
+        preambles = [c.trials - c.size for c in crossings]
+        if len(set(preambles)) > 1:
+            errors.append("Crossing blocks need different window preambles "
+                          f"({', '.join(map(str, preambles))} trials)")
+        for c, pre in zip(crossings, preambles):
+            if c.size and (trials - pre + c.size - 1) // c.size != 1:
+                errors.append(f"Crossing {', '.join(c.factors)} has {c.size} combinations, "
+                              f"which do not fill {trials} trials exactly once")
+    if max_trials is not None and trials > max_trials:
+        errors.append(f"{trials} trials per sequence exceed the limit of {max_trials}")
+    depth = max(widths.values(), default=1)
+    return DesignAnalysis(analysed, crossings, trials, depth, errors, notes)
+
+
+def check_design(data: dict, minimum_trials: int = 1, **analysis_kw) -> DesignAnalysis:
+    """
+    :func:`analyze_design`, raising ``ValueError`` with every error and
+    issuing each warning with :func:`warnings.warn`.
+
+    >>> check_design({"factors": [
+    ...     {"name": "c", "levels": [{"name": "x"}, {"name": "y"}]},
+    ...     {"name": "d", "levels": [{"name": "a", "expr": "c=='x'"}, {"name": "b", "expr": "c in ('x', 'y')"}]}],
+    ...     "crossing": [["c"]]})
+    Traceback (most recent call last):
+    ...
+    ValueError: Factor 'd' has several levels for 1 of 2 parent combinations, e.g. c='x' → a, b
+    """
+    analysis = analyze_design(data, minimum_trials, **analysis_kw)
+    if analysis.errors:
+        raise ValueError("\n".join(analysis.errors))
+    for note in analysis.warnings:
+        warnings.warn(note, stacklevel=2)
+    return analysis
@@ -0,0 +1,164 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from mate_structure.sweetpea.builder.analysis import DesignAnalysis, analyze_design
+from mate_structure.sweetpea.utils.convert import is_regular, is_window
+
+AUTO = "auto"
+
+# Seconds on one core (SweetPea 0.2.14), fitted to runs of designs up to
+# 30 trials with and without window factors:
+#   RandomGen      counting set-up, then almost nothing per sequence –
+#                  unless a crossing holds window factors: sequences are
+#                  then drawn and rejected until the windows fit, and
+#                  each one costs about RANDOM_WINDOW_GROWTH× more per
+#                  trial and window factor (a color × repeat crossing:
+#                  0.03 s at 9 trials, 0.25 s at 11, 4 s at 13)
+#   IterateSATGen  solver start-up, then a call per sequence growing with trials²
+RANDOM_SETUP, RANDOM_PER_SEQUENCE = 0.02, 0.001
+RANDOM_WINDOW, RANDOM_WINDOW_GROWTH = 4e-7, 3.5
+SAT_SETUP, SAT_FIRST, SAT_NEXT = 0.03, 0.0025, 0.0003
+
+
+# --------------------------------------------------------------------
+# cost model
+# --------------------------------------------------------------------
+def estimated_seconds(strategy: str, trials: int, samples: int, windows: int = 0) -> float:
+    """
+    Predicted time of ``synthesize_trials`` for *samples* sequences of
+    *trials* trials, where *strategy* can sample the design at all and
+    *windows* window factors are crossed.
+
+    >>> round(estimated_seconds("IterateSATGen", 30, 10), 2)
+    4.71
+    >>> round(estimated_seconds("RandomGen", 11, 5, windows=1), 2)
+    1.96
+    """
+    if strategy == "RandomGen":
+        rejection = RANDOM_WINDOW * RANDOM_WINDOW_GROWTH ** min(trials * windows, 500) if windows else 0
+        return RANDOM_SETUP + (RANDOM_PER_SEQUENCE + rejection) * samples
+    if strategy == "IterateSATGen":
+        return SAT_SETUP + trials ** 2 * (SAT_FIRST + SAT_NEXT * (samples - 1))
+    raise ValueError(f"No cost model for strategy {strategy!r}")
+
+
+def _crossed(data: dict) -> List[dict]:
+    """Factors in any crossing of *data*, in design order."""
+    crossing = data["crossing"]
+    blocks = [crossing] if isinstance(crossing[0], str) else crossing
+    names = {c for block in blocks for c in block}
+    return [f for f in data["factors"] if f["name"] in names]
+
+
+def crossed_windows(data: dict) -> List[str]:
+    """Window factors in any crossing of *data*."""
+    return sorted(f["name"] for f in _crossed(data) if is_window(f))
+
+
+def _random_gen_blockers(data: dict) -> List[str]:
+    """Why ``RandomGen`` cannot (in reasonable time) sample *data*."""
+    reasons = []
+    weighted = [f["name"] for f in _crossed(data)
+                if is_regular(f) and any(lv.get("weight", 1) != 1 for lv in f["levels"])]
+    if weighted:
+        reasons.append("RandomGen's solution counting stalls on weighted levels "
+                       f"of crossed factors ({', '.join(weighted)})")
+    return reasons
+
+
+# --------------------------------------------------------------------
+# choice
+# --------------------------------------------------------------------
+@dataclass
+class BuildParameters:
+    """
+    Build parameters picked for one design, with the reasons.
+
+    estimates: predicted seconds of each strategy that can sample it
+    """
+    minimum_trials: int
+    strategy: str
+    reasons: List[str]
+    estimates: Dict[str, float] = field(default_factory=dict)
+    analysis: DesignAnalysis | None = field(default=None, repr=False)
+
+    def comment(self) -> str:
+        """The choice as a block of ``#`` comment lines."""
+        return "\n".join(f"# {line}" for line in
+                         [f"minimum_trials = {self.minimum_trials}",
+                          f"strategy = {self.strategy}"] + self.reasons)
+
+
+def choose_parameters(
+    data: dict,
+    minimum_trials: int | str = AUTO,
+    strategy: str = AUTO,
+    samples: int = 1,
+) -> BuildParameters:
+    """
+    Resolve ``"auto"`` build parameters of the design *data*.
+
+    The trial count becomes the smallest the crossings allow: their
+    weighted sizes plus the preamble of their windows (see
+    :func:`analyze_design`).  The strategy is the cheapest, by
+    :func:`estimated_seconds` for *samples* sequences, of those able to
+    sample the design: ``RandomGen`` is left out when levels of a
+    crossed factor are weighted (uncrossed weights are no trouble), and its estimate grows quickly with the trials when a
+    crossing holds window factors.  Values other than ``"auto"``
+    are kept as they are.  Raises ``ValueError`` if the design cannot be
+    built at all.
+
+    Examples:
+        >>> design = {"factors": [
+        ...     {"name": "color", "levels": [{"name": "red"}, {"name": "blue"}]},
+        ...     {"name": "rep", "levels": [{"name": "y", "expr": "color[-1]==color[0]"},
+        ...                                {"name": "n", "expr": "color[-1]!=color[0]"}]}],
+        ...     "crossing": ["color", "rep"]}
+        >>> params = choose_parameters(design)
+        >>> print(params.comment())
+        # minimum_trials = 5
+        # strategy = RandomGen
+        # crossing color, rep needs 5 trials (4 combinations, 1 preamble)
+        # RandomGen rejects sequences until the windows fit (rep): ~3.5× per trial
+        # RandomGen: ~0.02 s for 1 sequence
+        # IterateSATGen: ~0.09 s for 1 sequence
+
+        Bigger window crossings go to the SAT solver:
+
+        >>> design["factors"][0]["levels"] += [{"name": "green"}, {"name": "grey"}]
+        >>> design["factors"].insert(1, {"name": "word", "levels": design["factors"][0]["levels"]})
+        >>> design["crossing"] = ["color", "word", "rep"]
+        >>> params = choose_parameters(design, samples=5)
+        >>> params.minimum_trials, params.strategy
+        (33, 'IterateSATGen')
+    """
+    analysis = analyze_design(data, 1 if minimum_trials == AUTO else minimum_trials)
+    if analysis.errors:
+        raise ValueError("\n".join(analysis.errors))
+    reasons: List[str] = []
+
+    if minimum_trials == AUTO:
+        minimum_trials = analysis.trials
+        for c in analysis.crossings:
+            preamble = c.trials - c.size
+            reasons.append(f"crossing {', '.join(c.factors)} needs {c.trials} trials "
+                           f"({c.size} combinations, {preamble} preamble)")
+
+    estimates: Dict[str, float] = {}
+    if strategy == AUTO:
+        blockers = _random_gen_blockers(data)
+        reasons += blockers
+        candidates = ["IterateSATGen"] if blockers else ["RandomGen", "IterateSATGen"]
+        windows = crossed_windows(data)
+        if windows and not blockers:
+            reasons.append(f"RandomGen rejects sequences until the windows fit "
+                           f"({', '.join(windows)}): ~{RANDOM_WINDOW_GROWTH:g}× per trial")
+        estimates = {s: estimated_seconds(s, analysis.trials, samples, len(windows))
+                     for s in candidates}
+        strategy = min(estimates, key=estimates.get)
+        plural = "" if samples == 1 else "s"
+        reasons += [f"{s}: ~{t:.2f} s for {samples} sequence{plural}"
+                    for s, t in estimates.items()]
+
+    return BuildParameters(minimum_trials, strategy, reasons, estimates, analysis)
@@ -0,0 +1,139 @@
+from __future__ import annotations
+import json
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+from mate_structure.sweetpea.builder.experimental_design import experimental_design_builder
+
+Validator = Callable[[dict], object]
+
+
+# --------------------------------------------------------------------
+# one record
+# --------------------------------------------------------------------
+def build_record(
+    text: str,
+    minimum_trials: int = 1,
+    strategy: str = "RandomGen",
+    validate: Validator | None = None,
+) -> dict:
+    """
+    Build one JSON design; never raises.
+
+    *validate* (e.g. an ``ExperimentSchema`` check) runs first and fails
+    the record by raising or returning a falsy value.
+
+    >>> build_record('{"factors": [{"name": "c", "levels": [{"name": "x"}]}], "crossing": [["c"]]}')["ok"]
+    True
+    >>> build_record('{"factors": [{"name": "a", "levels": [{"name": "x", "expr": "b==1"}]},'
+    ...              ' {"name": "b", "levels": [{"name": "y", "expr": "a==1"}]}], "crossing": [["a"]]}')
+    {'ok': False, 'source': None, 'error': 'ValueError: Cyclic dependency among factors: a, b'}
+    """
+    try:
+        data = json.loads(text)
+        if validate is not None and not validate(data):
+            raise ValueError("Design failed validation")
+        source = experimental_design_builder(data, minimum_trials, strategy)
+    except Exception as err:
+        return {"ok": False, "source": None, "error": f"{type(err).__name__}: {err}"}
+    return {"ok": True, "source": source, "error": None}
+
+
+def _build_batch(texts: List[str], minimum_trials, strategy, validate) -> List[dict]:
+    return [build_record(t, minimum_trials, strategy, validate) for t in texts]
+
+
+# --------------------------------------------------------------------
+# many records on a process pool
+# --------------------------------------------------------------------
+def build_batch(
+    lines: Iterable[str],
+    *,
+    workers: int | None = None,
+    batch: int = 64,
+    max_in_flight: int | None = None,
+    ordered: bool = True,
+    minimum_trials: int = 1,
+    strategy: str = "RandomGen",
+    validate: Validator | None = None,
+) -> Iterator[dict]:
+    """
+    Build every JSON design in *lines*, yielding one result per line.
+
+    Lines are sent to *workers* processes *batch* at a time, with at most
+    *max_in_flight* batches (default ``2 × workers``) submitted but not
+    yet yielded, so memory stays flat however long the input.  A record
+    that fails – bad JSON, a failed *validate*, a ``ValueError`` from the
+    builder – yields ``ok=False`` with the error and the run goes on.
+    Results come in input order, or as they finish with
+    ``ordered=False``; each carries its ``index``, the position of its
+    line in *lines* (blank lines are skipped but keep their number).
+
+    With ``workers <= 1`` everything runs in this process.
+
+    Examples:
+        >>> good = '{"factors": [{"name": "c", "levels": [{"name": "x"}]}], "crossing": [["c"]]}'
+        >>> [(r["index"], r["ok"]) for r in build_batch([good, "", "{", good], workers=1)]
+        [(0, True), (2, False), (3, True)]
+    """
+    options = (minimum_trials, strategy, validate)
+    numbered = ((i, line) for i, line in enumerate(lines) if line.strip())
+    chunks = iter(lambda: list(islice(numbered, batch)), [])
+
+    def results(chunk: List[Tuple[int, str]], built: List[dict]) -> Iterator[dict]:
+        for (i, _), record in zip(chunk, built):
+            yield {"index": i, **record}
+
+    workers = os.cpu_count() if workers is None else workers
+    if workers <= 1:
+        for chunk in chunks:
+            yield from results(chunk, _build_batch([t for _, t in chunk], *options))
+        return
+
+    limit = max_in_flight or 2 * workers
+    with ProcessPoolExecutor(workers) as pool:
+        pending: deque[Tuple[Future, List[Tuple[int, str]]]] = deque()
+
+        def done(future: Future, chunk) -> Iterator[dict]:
+            try:
+                built = future.result()
+            except Exception as err:            # worker died
+                error = f"{type(err).__name__}: {err}"
+                built = [{"ok": False, "source": None, "error": error}] * len(chunk)
+            yield from results(chunk, built)
+
+        for chunk in chunks:
+            pending.append((pool.submit(_build_batch, [t for _, t in chunk], *options), chunk))
+            while len(pending) >= limit:
+                if ordered:
+                    yield from done(*pending.popleft())
+                else:
+                    finished, _ = wait([f for f, _ in pending], return_when=FIRST_COMPLETED)
+                    for item in [p for p in pending if p[0] in finished]:
+                        pending.remove(item)
+                        yield from done(*item)
+
+        while pending:
+            yield from done(*pending.popleft())
+
+
+def build_jsonl(
+    src: str | os.PathLike,
+    dst: str | os.PathLike,
+    **batch_kw,
+) -> Dict[str, int]:
+    """
+    Stream the designs of the JSONL file *src* through :func:`build_batch`
+    into the JSONL file *dst* (one result line per design).
+
+    Returns the number of ``ok`` and ``failed`` records.
+    """
+    counts = {"ok": 0, "failed": 0}
+    with open(src) as lines, open(dst, "w") as out:
+        for record in build_batch(lines, **batch_kw):
+            counts["ok" if record["ok"] else "failed"] += 1
+            out.write(json.dumps(record) + "\n")
+    return counts
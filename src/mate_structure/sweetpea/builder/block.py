@@ -0,0 +1,103 @@
+from __future__ import annotations
+from typing import Dict, Tuple, Union
+
+from sweetpea import (
+    CrossBlock, DerivedLevel, Factor, Level, MinimumTrials, MultiCrossBlock,
+    Window, WithinTrial,
+)
+
+from mate_structure.sweetpea.builder.experimental_design import _topo_order
+from mate_structure.sweetpea.builder.expr import build_window, build_within, compile_lambda, parse_expr
+from mate_structure.sweetpea.builder.factor import check_factor, factor_deps
+from mate_structure.sweetpea.builder.level import check_level
+
+Block = Union[CrossBlock, MultiCrossBlock]
+
+
+# --------------------------------------------------------------------
+# live SweetPea objects, without generating and exec-ing source
+# --------------------------------------------------------------------
+def level_object(data: dict, factors: Dict[str, Factor]) -> Level | DerivedLevel:
+    """
+    Build a single level; *factors* maps names to the Factor objects
+    its ``expr`` reads.
+
+    >>> level_object({"name": "red", "weight": 2}, {})
+    Level<red>
+    """
+    check_level(data)                       # same checks as the source path
+    weight = data.get("weight", 1)
+    if "expr" not in data:
+        return Level(name=data["name"], weight=weight)
+
+    expr = data["expr"]
+    if parse_expr(expr).indexed:            # window derived
+        _, lam, deps, width = build_window(expr)
+        window = Window(compile_lambda(lam), [factors[d] for d in deps], width)
+    else:                                   # within derived
+        _, lam, deps, _ = build_within(expr)
+        window = WithinTrial(compile_lambda(lam), [factors[d] for d in deps])
+    return DerivedLevel(data["name"], window, weight)
+
+
+def factor_object(data: dict, factors: Dict[str, Factor]) -> Factor:
+    """Build a single Factor from its (validated) dict."""
+    check_factor(data)                      # raises on a missing name / levels
+    return Factor(data["name"], [level_object(lv, factors) for lv in data["levels"]])
+
+
+def design_objects(data: dict) -> Dict[str, Factor]:
+    """
+    All factors of an *ExperimentSchema* dict, in dependency order.
+
+    >>> fs = design_objects({"factors": [
+    ...     {"name": "rep", "levels": [{"name": "yes", "expr": "color[-1]==color[0]"}]},
+    ...     {"name": "color", "levels": [{"name": "red"}, {"name": "blue"}]}]})
+    >>> list(fs)
+    ['color', 'rep']
+    """
+    factors = data.get("factors")
+    if not factors:
+        raise ValueError("Factors cannot be None")
+
+    by_name = {f["name"]: f for f in factors}
+    built: Dict[str, Tuple[str, set]] = {f["name"]: ("", factor_deps(f)) for f in factors}
+
+    objects: Dict[str, Factor] = {}
+    for name in _topo_order(built):
+        objects[name] = factor_object(by_name[name], objects)
+    return objects
+
+
+def experimental_design_block(data: dict, minimum_trials: int | str = 1) -> Block:
+    """
+    Build the SweetPea block for an *ExperimentSchema*-validated dict;
+    ``minimum_trials="auto"`` asks for the fewest trials the crossings
+    allow.
+
+    The in-process counterpart of :func:`experimental_design_builder`,
+    which still writes the same design as a runnable script.
+
+    Examples:
+        >>> block = experimental_design_block({
+        ...     "factors": [{"name": "color", "levels": [{"name": "red"}, {"name": "blue"}]},
+        ...                 {"name": "word", "levels": [{"name": "red"}, {"name": "blue"}]}],
+        ...     "crossing": [["color", "word"]]})
+        >>> type(block).__name__, block.trials_per_sample()
+        ('MultiCrossBlock', 4)
+    """
+    crossing = data.get("crossing")
+    if not crossing:
+        raise ValueError("Crossing cannot be None")
+
+    if minimum_trials == "auto":
+        from mate_structure.sweetpea.builder.auto import choose_parameters  # numpy / pandas
+
+        minimum_trials = choose_parameters(data, "auto", "RandomGen").minimum_trials
+    objects = design_objects(data)
+    design = list(objects.values())
+    constraints = [MinimumTrials(minimum_trials)]
+    if isinstance(crossing[0], str):        # fully crossed
+        return CrossBlock(design, [objects[n] for n in crossing], constraints)
+    return MultiCrossBlock(design, [[objects[n] for n in block] for block in crossing],
+                           constraints)
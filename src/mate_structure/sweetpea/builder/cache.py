@@ -0,0 +1,214 @@
+from __future__ import annotations
+import ast
+import hashlib
+import json
+import os
+import shutil
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict
+
+from mate_structure.sweetpea.builder.block import Block, experimental_design_block
+from mate_structure.sweetpea.builder.experimental_design import experimental_design_builder
+from mate_structure.sweetpea.builder.expr import parse_expr
+
+
+# --------------------------------------------------------------------
+# canonical form and content hash of a design
+# --------------------------------------------------------------------
+def _expr(text: str) -> str:
+    """*text* with spacing and quoting normalised (``color == 'red'``)."""
+    parse_expr(text)                        # raises ValueError if invalid
+    return ast.unparse(ast.parse(text.strip(), mode="eval"))
+
+
+def canonical_design(data: dict) -> dict:
+    """
+    *data* with everything that does not change the design normalised:
+    factors, levels and the factors inside a crossing sorted by name,
+    a missing weight written as 1, exprs re-printed.  The order of the
+    crossings themselves is kept.
+
+    >>> canonical_design({"factors": [
+    ...     {"name": "word", "levels": [{"name": "red"}]},
+    ...     {"name": "color", "levels": [{"name": "red", "weight": 2}, {"name": "blue"}]},
+    ...     {"name": "con", "levels": [{"name": "yes", "expr": "color==word"}]}],
+    ...     "crossing": [["word", "color"]]})  # doctest: +NORMALIZE_WHITESPACE
+    {'factors': [{'name': 'color', 'levels': [{'name': 'blue', 'weight': 1}, {'name': 'red', 'weight': 2}]},
+                 {'name': 'con', 'levels': [{'name': 'yes', 'weight': 1, 'expr': 'color == word'}]},
+                 {'name': 'word', 'levels': [{'name': 'red', 'weight': 1}]}],
+     'crossing': [['color', 'word']]}
+    """
+    def level(lv: dict) -> dict:
+        out = {"name": lv["name"], "weight": lv.get("weight", 1)}
+        if "expr" in lv:
+            out["expr"] = _expr(lv["expr"])
+        return out
+
+    factors = sorted(
+        ({"name": f["name"],
+          "levels": sorted((level(lv) for lv in f["levels"]), key=lambda lv: lv["name"])}
+         for f in data["factors"]),
+        key=lambda f: f["name"])
+    crossing = data["crossing"]
+    if isinstance(crossing[0], str):        # fully crossed
+        crossing = sorted(crossing)
+    else:
+        crossing = [sorted(block) for block in crossing]
+    return {"factors": factors, "crossing": crossing}
+
+
+def design_hash(data: dict, **options) -> str:
+    """
+    SHA-256 of the canonical design plus build *options*
+    (``minimum_trials``, ``strategy``, …).
+
+    >>> a = {"factors": [{"name": "c", "levels": [{"name": "x"}, {"name": "y"}]}], "crossing": [["c"]]}
+    >>> b = {"factors": [{"name": "c", "levels": [{"name": "y", "weight": 1}, {"name": "x"}]}], "crossing": [["c"]]}
+    >>> design_hash(a) == design_hash(b), design_hash(a) == design_hash(a, minimum_trials=4)
+    (True, False)
+    >>> design_hash(a) == design_hash({**a, "factors": [
+    ...     {"name": "c", "levels": [{"name": "x", "weight": 0}, {"name": "y"}]}]})
+    False
+    """
+    payload = {"design": canonical_design(data), "options": options}
+    text = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+# --------------------------------------------------------------------
+# two-tier cache: in-memory LRU, then a directory on disk
+# --------------------------------------------------------------------
+@dataclass
+class BuiltDesign:
+    """
+    Everything built for one design.
+
+    key:    :func:`design_hash` of the design and build options
+    design: the design dict as first submitted
+    source: the script from :func:`experimental_design_builder`
+    block:  the live block from :func:`experimental_design_block`
+    """
+    key: str
+    design: dict
+    source: str
+    block: Block = field(repr=False)
+
+
+class DesignCache:
+    """
+    Content-addressed cache of built designs.
+
+    A design is looked up by :func:`design_hash`, first among the
+    *max_items* most recently used ones kept in memory, then in
+    *directory*.  A memory hit returns the cached objects as they are;
+    pass its ``block`` to :func:`draw_sequences` to sample without
+    building again.  SweetPea blocks cannot be pickled, so the disk tier
+    keeps the design and the generated source, and a disk hit rebuilds
+    only the block, in process.  The least recently used entries on disk
+    are deleted once they take more than *max_bytes*.
+
+    Examples:
+        >>> cache = DesignCache()
+        >>> design = {"factors": [{"name": "color", "levels": [{"name": "red"}, {"name": "blue"}]}],
+        ...           "crossing": [["color"]]}
+        >>> cache.get(design) is cache.get(design)
+        True
+        >>> cache.stats
+        {'memory': 1, 'disk': 0, 'miss': 1}
+        >>> from mate_structure.sweetpea.builder.synthesis import draw_sequences
+        >>> len(list(draw_sequences(cache.get(design).block, 3, seed=0)))
+        3
+    """
+
+    def __init__(
+        self,
+        directory: str | os.PathLike | None = None,
+        *,
+        max_items: int = 128,
+        max_bytes: int = 1 << 30,
+    ):
+        self.directory = Path(directory) if directory is not None else None
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.stats: Dict[str, int] = {"memory": 0, "disk": 0, "miss": 0}
+        self._memory: OrderedDict[str, BuiltDesign] = OrderedDict()
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    def get(self, data: dict, minimum_trials: int = 1, strategy: str = "RandomGen") -> BuiltDesign:
+        """The built design for *data*, from the cache if possible."""
+        key = design_hash(data, minimum_trials=minimum_trials, strategy=strategy)
+
+        built = self._memory.get(key)
+        if built is not None:
+            self._memory.move_to_end(key)
+            self.stats["memory"] += 1
+            return built
+
+        built = self._load(key, minimum_trials)
+        if built is not None:
+            self.stats["disk"] += 1
+        else:
+            self.stats["miss"] += 1
+            built = BuiltDesign(key, data,
+                                experimental_design_builder(data, minimum_trials, strategy),
+                                experimental_design_block(data, minimum_trials))
+            self._store(built)
+
+        self._memory[key] = built
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+        return built
+
+    def clear(self) -> None:
+        """Empty both tiers."""
+        self._memory.clear()
+        if self.directory is not None:
+            for entry in self.directory.iterdir():
+                shutil.rmtree(entry, ignore_errors=True)
+
+    # ------------------------------------------------------------------
+    def _load(self, key: str, minimum_trials: int) -> BuiltDesign | None:
+        if self.directory is None or not (self.directory / key).is_dir():
+            return None
+        entry = self.directory / key
+        try:
+            design = json.loads((entry / "design.json").read_text())
+            source = (entry / "source.py").read_text()
+        except (OSError, ValueError):
+            return None                     # half-written / damaged entry
+        block = experimental_design_block(design, minimum_trials)
+        os.utime(entry)                     # mark as recently used
+        return BuiltDesign(key, design, source, block)
+
+    def _store(self, built: BuiltDesign) -> None:
+        if self.directory is None:
+            return
+        entry = self.directory / built.key
+        tmp = self.directory / f".{built.key}.{os.getpid()}"
+        tmp.mkdir(exist_ok=True)
+        (tmp / "design.json").write_text(json.dumps(built.design))
+        (tmp / "source.py").write_text(built.source)
+        try:
+            os.replace(tmp, entry)
+        except OSError:                     # stored meanwhile by another process
+            shutil.rmtree(tmp, ignore_errors=True)
+        self._evict(keep=built.key)
+
+    def _evict(self, keep: str) -> None:
+        """Drop the least recently used entries until the directory fits *max_bytes*."""
+        entries = []
+        for entry in self.directory.iterdir():
+            if entry.name.startswith(".") or not entry.is_dir():
+                continue
+            size = sum(f.stat().st_size for f in entry.iterdir())
+            entries.append((entry.stat().st_mtime, size, entry))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if entry.name != keep:
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
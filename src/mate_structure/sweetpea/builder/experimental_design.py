@@ -53,10 +53,15 @@ def _crossing_to_code(crossing: List, ordered_names: List[str]) -> str:
 
 
 # --------------------------------------------------------------------
-def experimental_design_builder(data: dict, minimum_trials: int = 1, strategy='RandomGen') -> str:
+def experimental_design_builder(data: dict, minimum_trials: int | str = 1,
+                                strategy='RandomGen', samples: int = 1) -> str:
     """
     Build runnable SweetPea code for an *ExperimentSchema*-validated dict.
 
+    *minimum_trials* and *strategy* may be ``"auto"``: they are then
+    picked for the design and *samples* sequences by
+    :func:`choose_parameters`, whose reasons head the script.
+
     Returns the complete Python source as a single string.
     """
     factors   = data.get("factors")
@@ -67,6 +72,14 @@ def experimental_design_builder(data: dict, minimum_trials: int = 1, strategy='R
     if not crossing:
         raise ValueError("Crossing cannot be None")
 
+    chosen = ""
+    if "auto" in (minimum_trials, strategy):
+        from mate_structure.sweetpea.builder.auto import choose_parameters  # numpy / pandas
+
+        params = choose_parameters(data, minimum_trials, strategy, samples)
+        minimum_trials, strategy = params.minimum_trials, params.strategy
+        chosen = "\n# ---------- build parameters ----------\n" + params.comment() + "\n"
+
     # ---------- build each factor once, collect deps -----------------
     built: Dict[str, Tuple[str, set]] = {}
     for f in factors:
@@ -95,7 +108,7 @@ def experimental_design_builder(data: dict, minimum_trials: int = 1, strategy='R
     )
 
     footer = (
-        f"\nexperiments = synthesize_trials(block, 1, sampling_strategy={strategy})\n"
+        f"\nexperiments = synthesize_trials(block, {samples}, sampling_strategy={strategy})\n"
         "print_experiments(block, experiments)\n"
 
     )
@@ -104,6 +117,7 @@ def experimental_design_builder(data: dict, minimum_trials: int = 1, strategy='R
 
     full_source = (
         header
+        + chosen
         + "\n# ---------- factor declarations ----------\n"
         + factor_decls
         + "\n\n# ---------- design / crossing / block ----------\n"
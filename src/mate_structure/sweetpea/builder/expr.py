@@ -1,45 +1,142 @@
 from __future__ import annotations
-import re
-from typing import List, Tuple
+import ast
+from dataclasses import dataclass, field
+from functools import lru_cache
+from types import CodeType
+from typing import Callable, List, Tuple
 
-_OPERATORS = {"and", "or", "not", "True", "False", "None", "in", "is"}
+Ref = Tuple[str, int]                       # (factor name, trial offset)
 
 
-def _unique(seq: List[str]) -> List[str]:
-    seen = set();
-    out = []
-    for x in seq:
-        if x not in seen:
-            seen.add(x);
-            out.append(x)
-    return out
+# ----------------------------------------------------------------------
+# parse-once expression IR
+# ----------------------------------------------------------------------
+def _offset(node: ast.expr) -> int | None:
+    """Integer literal used as a window index (``0``, ``-1``, …)."""
+    if isinstance(node, ast.Constant) and type(node.value) is int:
+        return node.value
+    if (isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub)
+            and isinstance(node.operand, ast.Constant)
+            and type(node.operand.value) is int):
+        return -node.operand.value
+    return None
+
+
+class _Flatten(ast.NodeTransformer):
+    """
+    Replace each factor reference by a positional argument ``_i``,
+    in source order.
 
+    ``color[-1]`` → ref ``('color', -1)``; a bare ``color`` is treated
+    exactly like ``color[0]``.
+    """
 
-# ----------------------------------------------------------------------
-def _strip_strings(expr: str) -> str:
-    """Remove single- or double-quoted string literals from expr."""
-    return re.sub(r"(\"[^\"]*\"|'[^']*')", " ", expr)
+    def __init__(self):
+        self.refs: List[Ref] = []
+        self.indexed = False
+        self.has_subscript = False
 
+    def _arg(self, ref: Ref) -> ast.Name:
+        if ref not in self.refs:
+            self.refs.append(ref)
+        return ast.Name(id=f"_{self.refs.index(ref)}", ctx=ast.Load())
 
-def _vars_within(expr: str) -> List[str]:
+    def visit_Subscript(self, node):
+        self.has_subscript = True
+        k = _offset(node.slice)
+        if isinstance(node.value, ast.Name) and k is not None:
+            self.indexed = True
+            return self._arg((node.value.id, k))
+        return self.generic_visit(node)
+
+    def visit_Name(self, node):
+        return self._arg((node.id, 0))
+
+
+@dataclass(frozen=True)
+class ExprIR:
     """
-    Identifiers in a within-trial expression, excluding operators *and*
-    anything that was inside quotes.
+    A level ``expr`` parsed once.
+
+    text:      the expression as written
+    variables: referenced factor names, in order of appearance
+    refs:      every distinct ``(factor, offset)`` pair; bare names are offset 0
+    width:     window width (1 + the largest look-back)
+    indexed:   True if any factor is referenced as ``name[k]``
+    has_subscript: True if *any* ``x[...]`` appears (``color[i]`` too)
+    body:      the expression with ``refs[i]`` replaced by the name ``_i``
+    code:      compiled ``lambda _0, _1, …: body``
+    fn:        the function built from ``code``
+
+    Examples:
+        >>> ir = parse_expr("congruency[-1]=='congruent' and congruency[0]!=word")
+        >>> ir.variables, ir.refs, ir.width, ir.indexed
+        (('congruency', 'word'), (('congruency', -1), ('congruency', 0), ('word', 0)), 2, True)
+        >>> ir.fn('congruent', 'neutral', 'red')
+        True
+        >>> parse_expr("color==word").width
+        1
+        >>> ir = parse_expr("color[i]=='red'")
+        >>> ir.indexed, ir.has_subscript
+        (False, True)
+    """
+    text: str
+    variables: Tuple[str, ...]
+    refs: Tuple[Ref, ...]
+    width: int
+    indexed: bool
+    has_subscript: bool
+    body: ast.expr = field(repr=False, compare=False)
+    code: CodeType = field(repr=False, compare=False)
+    fn: Callable = field(repr=False, compare=False)
+
+
+def lambda_code(body: ast.expr, n_args: int) -> CodeType:
+    """Compile ``lambda _0, …, _{n_args-1}: body``."""
+    params = [ast.arg(arg=f"_{i}") for i in range(n_args)]
+    lam = ast.Expression(ast.Lambda(
+        args=ast.arguments(posonlyargs=[], args=params, kwonlyargs=[],
+                           kw_defaults=[], defaults=[]),
+        body=body))
+    return compile(ast.fix_missing_locations(lam), "<expr>", "eval")
+
+
+@lru_cache(maxsize=4096)
+def compile_lambda(lam: str) -> Callable:
+    """
+    Function of a ``lambda …: expr`` source as written by
+    :func:`build_within` / :func:`build_window` (cached by the text).
+
+    >>> compile_lambda(build_within("color==word")[1])("red", "red")
+    True
     """
-    expr_no_strings = _strip_strings(expr)
-    tokens = re.findall(r"[A-Za-z_][A-Za-z0-9_]*", expr_no_strings)
-    return [t for t in dict.fromkeys(tokens) if t not in _OPERATORS]
+    return eval(compile(lam, "<expr>", "eval"), {})
 
 
-def _vars_window(expr: str) -> List[str]:
+@lru_cache(maxsize=4096)
+def parse_expr(expr: str) -> ExprIR:
     """
-    Identifiers (base names) that appear before a bracket *or* bare,
-    again stripping string literals first.
+    Parse *expr* into an :class:`ExprIR` (cached by the expression text).
+
+    >>> parse_expr("color==")  # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    ValueError: Cannot parse expression 'color=='...
     """
-    expr_no_strings = _strip_strings(expr)
-    indexed = re.findall(r"([A-Za-z_][A-Za-z0-9_]*)\s*\[", expr_no_strings)
-    bare = re.findall(r"\b([A-Za-z_][A-Za-z0-9_]*)\b", expr_no_strings)
-    return [t for t in dict.fromkeys(indexed + bare) if t not in _OPERATORS]
+    try:
+        tree = ast.parse(expr.strip(), mode="eval")
+    except SyntaxError as err:
+        raise ValueError(f"Cannot parse expression {expr!r}: {err.msg}") from err
+
+    flat = _Flatten()
+    body = flat.visit(tree).body
+    refs = tuple(flat.refs)
+    variables = tuple(dict.fromkeys(name for name, _ in refs))
+    width = 1 + max([0] + [-k for _, k in refs])
+
+    code = lambda_code(body, len(refs))
+    return ExprIR(expr, variables, refs, width, flat.indexed, flat.has_subscript,
+                  body, code, eval(code, {}))
 
 
 # ------------------------------------------------------------------ #
@@ -50,19 +147,19 @@ def build_within(expr: str) -> tuple[str, str, list[str], int]:
     builds within expression
 
     Examples:
-        >>> build_within('color==word')
+        >>> build_within('color==word')[0]
         'WithinTrial(lambda color, word: color==word, [color, word])'
 
-        >>> build_within('color=="red" and word=="green"')
+        >>> build_within('color=="red" and word=="green"')[0]
         'WithinTrial(lambda color, word: color=="red" and word=="green", [color, word])'
 
-        >>> build_within('color=="red" or word==1')
+        >>> build_within('color=="red" or word==1')[0]
         'WithinTrial(lambda color, word: color=="red" or word==1, [color, word])'
 
         >>> build_within('size>2')
-        'WithinTrial(lambda size: size>2, [size])'
+        ('WithinTrial(lambda size: size>2, [size])', 'lambda size: size>2', ['size'], 0)
     """
-    vars_ = _vars_within(expr)
+    vars_ = list(parse_expr(expr).variables)
     varlist = ", ".join(vars_)
     lam = f"lambda {varlist}: {expr}"
     call = f"WithinTrial({lam}, [{', '.join(vars_)}])"
@@ -71,24 +168,20 @@ def build_within(expr: str) -> tuple[str, str, list[str], int]:
 
 def build_window(expr: str) -> tuple[str, str, list[str], int]:
     """
-    >>> build_window('color[-1]==color[0]')
+    >>> build_window('color[-1]==color[0]')[0]
     'Window(lambda color: color[-1]==color[0], [color], 2)'
 
-    >>> build_window('color[-1]==word[0] and word[-1]=="green"')
+    >>> build_window('color[-1]==word[0] and word[-1]=="green"')[0]
     'Window(lambda color, word: color[-1]==word[0] and word[-1]=="green", [color, word], 2)'
 
     >>> build_window('color[-2]==color[0] and color[-1]==color[0]')
-    'Window(lambda color: color[-2]==color[0] and color[-1]==color[0], [color], 3)'
+    ('Window(lambda color: color[-2]==color[0] and color[-1]==color[0], [color], 3)', 'lambda color: color[-2]==color[0] and color[-1]==color[0]', ['color'], 3)
 
     """
-    # factor names that appear before a bracket (string-literals already stripped)
-    base = _vars_window(expr)                 # e.g. ['color']
+    ir = parse_expr(expr)
+    base = list(ir.variables)                 # e.g. ['color']
     params = ", ".join(base)                  # 'color'
     lam = f"lambda {params}: {expr}"          # 'lambda color: color[-1]==color[0]'
 
-    # find negative indices → window size = largest |index|
-    neg_indices = [int(i) for i in re.findall(r"\[(-?\d+)\]", expr) if int(i) < 0]
-    width = max(abs(i) for i in neg_indices) + 1   # default 1
-
-    call = f"Window({lam}, [{', '.join(base)}], {width})"         # stride=1
-    return call, lam, base, width
+    call = f"Window({lam}, [{', '.join(base)}], {ir.width})"      # stride=1
+    return call, lam, base, ir.width
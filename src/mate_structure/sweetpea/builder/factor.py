@@ -1,10 +1,36 @@
-from mate_structure.sweetpea.builder.level import level_builder
+from mate_structure.sweetpea.builder.expr import parse_expr
+from mate_structure.sweetpea.builder.level import check_level, level_builder
 
 def _py(name: str) -> str:
     """Sanitise for a valid Python identifier if needed."""
     return name.strip().replace(" ", "_").replace("-", "_")
 
 
+def check_factor(data: dict) -> None:
+    """Raise ``ValueError`` if a factor has no name or no levels."""
+    if not data.get("name"):
+        raise ValueError("Factor name cannot be None")
+    if not data.get("levels"):
+        raise ValueError("Factor levels cannot be None")
+
+
+def factor_deps(data: dict) -> set:
+    """
+    The checks of :func:`factor_build` and the factors its derived
+    levels read, without writing any source.
+
+    >>> sorted(factor_deps({"name": "con", "levels": [{"name": "y", "expr": "color==word"}]}))
+    ['color', 'word']
+    """
+    check_factor(data)
+    deps = set()
+    for lv in data["levels"]:
+        check_level(lv)
+        if "expr" in lv:
+            deps.update(parse_expr(lv["expr"]).variables)
+    return deps
+
+
 def factor_build(data: dict):
     """
     Build a single Factor declaration.
@@ -15,14 +41,10 @@ def factor_build(data: dict):
     deps        : set[str]   # other factor names referenced in *any*
                              # derived level of this factor
     """
+    check_factor(data)
     name   = data.get("name")
     levels = data.get("levels")
 
-    if not name:
-        raise ValueError("Factor name cannot be None")
-    if not levels:
-        raise ValueError("Factor levels cannot be None")
-
     level_codes = []
     deps = set()
 
@@ -1,12 +1,27 @@
-import re
 from typing import List, Tuple
 
-from mate_structure.sweetpea.builder.expr import build_within, build_window
+from mate_structure.sweetpea.builder.expr import build_within, build_window, parse_expr
 
 
 # ----------------------------------------------------------------------
 # helpers
 # ----------------------------------------------------------------------
+def check_level(data: dict) -> None:
+    """
+    Raise ``ValueError`` if a level has no name, or a derived level no expr.
+
+    >>> check_level({"name": "rep", "expr": None})
+    Traceback (most recent call last):
+    ...
+    ValueError: Level name or expr cannot be None
+    """
+    if "expr" not in data:
+        if not data.get("name"):
+            raise ValueError("Level name cannot be None")
+    elif not data.get("name") or not data.get("expr"):
+        raise ValueError("Level name or expr cannot be None")
+
+
 def regular_level_builder(data) -> Tuple[str, List[str]]:
     """
     Build a static level.
@@ -18,10 +33,9 @@ def regular_level_builder(data) -> Tuple[str, List[str]]:
     ...
     ValueError: Level name cannot be None
     """
+    check_level(data)
     name = data.get("name")
     weight = data.get("weight", 1)
-    if not name:
-        raise ValueError("Level name cannot be None")
     return f'Level(name="{name}", weight={weight})', []
 
 
@@ -34,8 +48,7 @@ def within_derived_level_builder(data) -> Tuple[str, List[str]]:
     name = data.get("name")
     expr = data.get("expr")
     weight = data.get("weight", 1)
-    if not name or not expr:
-        raise ValueError("Level name or expr cannot be None")
+    check_level(data)
 
     call, _, deps, _ = build_within(expr)  # deps bubbles up
     return f'DerivedLevel("{name}", {call}, {weight})', deps
@@ -50,8 +63,7 @@ def window_derived_level_builder(data) -> Tuple[str, List[str]]:
     name = data.get("name")
     expr = data.get("expr")
     weight = data.get("weight", 1)
-    if not name or not expr:
-        raise ValueError("Level name or expr cannot be None")
+    check_level(data)
 
     call, _, deps, _ = build_window(expr)
     return f'DerivedLevel("{name}", {call}, {weight})', deps
@@ -60,8 +72,6 @@ def window_derived_level_builder(data) -> Tuple[str, List[str]]:
 # ----------------------------------------------------------------------
 # dispatcher with indexing test
 # ----------------------------------------------------------------------
-_INDEX_PATTERN = re.compile(r"\[-?\d+\]")  # matches [0] , [-1] , ...
-
 
 def level_builder(data: dict) -> Tuple[str, List[str]]:
     """
@@ -77,7 +87,7 @@ def level_builder(data: dict) -> Tuple[str, List[str]]:
     if "expr" not in data:  # static level
         return regular_level_builder(data)
 
-    if _INDEX_PATTERN.search(data["expr"]):  # window derived
+    if parse_expr(data["expr"]).indexed:  # window derived
         return window_derived_level_builder(data)
 
     return within_derived_level_builder(data)  # within derived
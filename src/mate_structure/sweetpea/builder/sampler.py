@@ -0,0 +1,210 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Any, Iterator, List
+
+import numpy as np
+import pandas as pd
+
+from mate_structure.sweetpea.builder.expr import parse_expr
+from mate_structure.sweetpea.builder.synthesis import draw_sequences
+from mate_structure.sweetpea.utils.convert import derive_levels, is_regular
+from mate_structure.sweetpea.utils.convert.lookup import MAX_CELLS
+
+
+# --------------------------------------------------------------------
+# design analysis
+# --------------------------------------------------------------------
+def window_factors(data: dict) -> List[str]:
+    """
+    Factors with a window-derived level – the same test
+    :func:`level_builder` dispatches on.
+
+    >>> window_factors({"factors": [
+    ...     {"name": "color", "levels": [{"name": "red"}]},
+    ...     {"name": "rep", "levels": [{"name": "y", "expr": "color[-1]==color[0]"}]}]})
+    ['rep']
+    """
+    return [f["name"] for f in data["factors"]
+            if any(parse_expr(lv["expr"]).indexed for lv in f["levels"] if "expr" in lv)]
+
+
+def _weights(factor: dict) -> np.ndarray:
+    """Level weights as SweetPea applies them, derived levels included."""
+    return np.array([lv.get("weight") or 1 for lv in factor["levels"]], dtype=np.float64)
+
+
+# --------------------------------------------------------------------
+# constructive sampler: weighted crossing → trials → shuffle
+# --------------------------------------------------------------------
+@dataclass(frozen=True)
+class ConstructivePlan:
+    """
+    Everything needed to draw sequences of a design without windows.
+
+    names:    factor names, in design order
+    levels:   level names of each factor
+    rows:     ``(assignments, factors)`` level codes of every valid trial
+    cum:      cumulative weight of ``rows`` (sorted by crossing cell)
+    start:    per cell, cumulative weight before its first row
+    total:    per cell, summed weight of its rows
+    cells:    crossing cell of each trial of a whole number of crossings
+    trials:   trials per sequence; a shuffle of ``cells`` cut to length
+    """
+    names: List[str]
+    levels: List[np.ndarray]
+    rows: np.ndarray
+    cum: np.ndarray
+    start: np.ndarray
+    total: np.ndarray
+    cells: np.ndarray
+    trials: int
+
+    def sample_codes(self, count: int, rng: np.random.Generator) -> np.ndarray:
+        """``(count, trials, factors)`` level codes of *count* sequences."""
+        cells = rng.permuted(np.broadcast_to(self.cells, (count, len(self.cells))), axis=1)
+        cells = cells[:, :self.trials]
+        target = self.start[cells] + rng.random(cells.shape) * self.total[cells]
+        picked = np.searchsorted(self.cum, target, side="right")
+        return self.rows[np.minimum(picked, len(self.rows) - 1)]
+
+    def sample(self, count: int, rng: np.random.Generator) -> List[dict]:
+        """*count* sequences in SweetPea's format (factor name → level names)."""
+        codes = self.sample_codes(count, rng)
+        return [{name: self.levels[f][seq[:, f]].tolist()
+                 for f, name in enumerate(self.names)}
+                for seq in codes]
+
+
+def plan_design(data: dict, minimum_trials: int = 1,
+                max_cells: int = MAX_CELLS) -> ConstructivePlan | None:
+    """
+    A :class:`ConstructivePlan` for *data*, or None if SweetPea is needed:
+    window factors, more than one crossing, exprs that read something
+    other than factors, or more than *max_cells* regular combinations.
+
+    Every combination of the regular levels is a candidate trial; within
+    levels are derived for it and combinations where a derived factor has
+    no level are dropped.  A sequence holds each reachable cell of the
+    crossing as often as the product of its level weights, derived
+    levels included; as in SweetPea, *minimum_trials* beyond that
+    repeats the crossing and the last repetition may be partial.  Each
+    trial takes one of the cell's combinations, drawn by the weights of
+    the uncrossed factors, and the trials are shuffled.
+
+    Examples:
+        >>> from mate_structure.sweetpea.builder.block import experimental_design_block
+        >>> design = {"factors": [
+        ...     {"name": "color", "levels": [{"name": "red"}, {"name": "blue", "weight": 2}]},
+        ...     {"name": "word", "levels": [{"name": "red"}, {"name": "blue"}]},
+        ...     {"name": "con", "levels": [{"name": "yes", "expr": "color==word", "weight": 3},
+        ...                                {"name": "no", "expr": "color!=word"}]}],
+        ...     "crossing": [["color", "con"]]}
+        >>> plan = plan_design(design)
+        >>> plan.trials == experimental_design_block(design).trials_per_sample()
+        True
+        >>> dict(zip(["red/yes", "red/no", "blue/yes", "blue/no"], np.bincount(plan.cells).tolist()))
+        {'red/yes': 3, 'red/no': 1, 'blue/yes': 6, 'blue/no': 2}
+    """
+    crossing = data["crossing"]
+    if not isinstance(crossing[0], str):
+        if len(crossing) != 1:
+            return None
+        crossing = crossing[0]
+    if window_factors(data):
+        return None
+
+    factors = data["factors"]
+    names = [f["name"] for f in factors]
+    if any(name not in names for lv in (lv for f in factors for lv in f["levels"])
+           if "expr" in lv for name in parse_expr(lv["expr"]).variables):
+        return None
+    regular = [f for f in factors if is_regular(f)]
+    sizes = [len(f["levels"]) for f in regular]
+    n = int(np.prod(sizes, dtype=np.float64))
+    if n > max_cells:
+        return None
+
+    # every combination of regular levels, with its derived levels
+    grid = np.indices(sizes).reshape(len(regular), n)
+    inputs = pd.DataFrame({
+        f["name"]: pd.Categorical.from_codes(grid[a], [lv["name"] for lv in f["levels"]])
+        for a, f in enumerate(regular)
+    })
+    derived = derive_levels(inputs, factors)
+    codes = {f["name"]: grid[a] for a, f in enumerate(regular)}
+    codes.update(derived)
+    by_name = {f["name"]: f for f in factors}
+    valid = np.ones(n, dtype=bool)
+    for name in derived:
+        valid &= codes[name] < len(by_name[name]["levels"])
+
+    # crossing cell of each combination; weight of its uncrossed levels
+    cell = np.zeros(n, dtype=np.int64)
+    cell_weight = np.ones(1)
+    for name in crossing:
+        cell = cell * len(by_name[name]["levels"]) + codes[name]
+        cell_weight = np.multiply.outer(cell_weight, _weights(by_name[name])).ravel()
+    row_weight = np.ones(n)
+    for a, f in enumerate(regular):
+        if f["name"] not in crossing:
+            row_weight *= _weights(f)[grid[a]]
+
+    keep = np.flatnonzero(valid)
+    order = keep[np.argsort(cell[keep], kind="stable")]
+    rows = np.stack([codes[name][order] for name in names], axis=1).astype(np.int64)
+    cum = np.cumsum(row_weight[order])
+    n_cells = len(cell_weight)
+    total = np.bincount(cell[order], weights=row_weight[order], minlength=n_cells)
+    start = np.concatenate([[0.0], np.cumsum(total)[:-1]])
+
+    reachable = np.flatnonzero(total > 0)
+    weights = cell_weight[reachable].astype(np.int64)
+    size = int(weights.sum())
+    if size == 0:
+        return None
+    trials = max(minimum_trials, size)
+    cells = np.tile(np.repeat(reachable, weights), -(-trials // size))
+    levels = [np.array([lv["name"] for lv in f["levels"]], dtype=object) for f in factors]
+    return ConstructivePlan(names, levels, rows, cum, start, total, cells, trials)
+
+
+def sample_sequences(
+    data: dict,
+    count: int | None = None,
+    *,
+    seed: int | None = None,
+    minimum_trials: int = 1,
+    strategy: Any = "RandomGen",
+    batch: int = 1024,
+) -> Iterator[dict]:
+    """
+    Yield *count* sequences (endless with None) of the design *data*.
+
+    Designs without window factors are drawn directly with
+    :class:`ConstructivePlan`, *batch* sequences per NumPy call; all
+    others go through SweetPea via :func:`draw_sequences` with
+    *strategy*.  A *seed* makes either stream reproducible.
+
+    Examples:
+        >>> design = {"factors": [
+        ...     {"name": "color", "levels": [{"name": "red"}, {"name": "blue", "weight": 2}]},
+        ...     {"name": "word", "levels": [{"name": "red"}, {"name": "blue"}]},
+        ...     {"name": "con", "levels": [{"name": "yes", "expr": "color==word"},
+        ...                                {"name": "no", "expr": "color!=word"}]}],
+        ...     "crossing": [["color", "con"]]}
+        >>> seq = next(sample_sequences(design, 1, seed=0))
+        >>> sorted(zip(seq["color"], seq["word"], seq["con"]))
+        [('blue', 'blue', 'yes'), ('blue', 'blue', 'yes'), ('blue', 'red', 'no'), ('blue', 'red', 'no'), ('red', 'blue', 'no'), ('red', 'red', 'yes')]
+    """
+    plan = plan_design(data, minimum_trials)
+    if plan is None:
+        yield from draw_sequences(data, count, strategy=strategy, seed=seed,
+                                  minimum_trials=minimum_trials)
+        return
+
+    rng = np.random.default_rng(seed)
+    drawn = 0
+    while count is None or drawn < count:
+        n = batch if count is None else min(batch, count - drawn)
+        yield from plan.sample(n, rng)
+        drawn += n
@@ -0,0 +1,338 @@
+from __future__ import annotations
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+from multiprocessing.connection import wait
+from typing import Any, Dict, Iterable, Iterator, List
+
+import numpy as np
+import sweetpea
+
+from mate_structure.sweetpea.builder.auto import AUTO, choose_parameters
+from mate_structure.sweetpea.builder.block import Block, experimental_design_block
+
+
+# --------------------------------------------------------------------
+# helpers
+# --------------------------------------------------------------------
+def sampling_strategy(strategy: Any):
+    """A SweetPea ``Gen`` from its name (``"RandomGen"``); Gens pass through."""
+    if isinstance(strategy, str):
+        gen = getattr(sweetpea, strategy, None)
+        if not (isinstance(gen, type) and issubclass(gen, sweetpea.Gen)):
+            raise ValueError(f"Unknown sampling strategy {strategy!r}")
+        return gen
+    return strategy
+
+
+def seed_all(seed: int | None) -> None:
+    """Seed the generators SweetPea's samplers draw from."""
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed % 2 ** 32)
+
+
+def synthesize(block: Block, samples: int, strategy: Any = "RandomGen") -> List[dict]:
+    """``synthesize_trials`` without its progress output."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return sweetpea.synthesize_trials(block, samples,
+                                          sampling_strategy=sampling_strategy(strategy))
+
+
+# --------------------------------------------------------------------
+# many sequences from one block
+# --------------------------------------------------------------------
+class _Stream:
+    """Private state of ``random`` / ``np.random``, swapped in while drawing."""
+
+    def __init__(self, seed: int | None):
+        saved = random.getstate(), np.random.get_state()
+        seed_all(seed if seed is not None else random.SystemRandom().randrange(2 ** 63))
+        self.state = random.getstate(), np.random.get_state()
+        random.setstate(saved[0])
+        np.random.set_state(saved[1])
+
+    @contextlib.contextmanager
+    def active(self):
+        saved = random.getstate(), np.random.get_state()
+        random.setstate(self.state[0])
+        np.random.set_state(self.state[1])
+        try:
+            yield
+        finally:
+            self.state = random.getstate(), np.random.get_state()
+            random.setstate(saved[0])
+            np.random.set_state(saved[1])
+
+
+# RandomGen builds a ``UCSolutionEnumerator`` – the solution counting
+# that makes up nearly all of a call – on every call.  Its module name
+# for that class is routed, once per process, through a hook that hands
+# back the enumerator memoised by the draw running in the calling
+# thread, and builds a new one otherwise.  The hook relies on SweetPea
+# internals, so it is only installed on the versions checked here.
+ENUMERATOR_VERSIONS = ("0.2.",)
+_draw = threading.local()               # (block, memo) of this thread's draw
+_install = threading.Lock()
+
+
+def _enumerator_hook() -> bool:
+    """Install the memoising enumerator hook; False where it cannot be."""
+    from importlib.metadata import version
+
+    if not version("sweetpea").startswith(ENUMERATOR_VERSIONS):
+        return False
+    try:
+        from sweetpea._internal.sampling_strategy import random as random_gen
+    except ImportError:
+        return False
+    with _install:
+        make = getattr(random_gen, "UCSolutionEnumerator", None)
+        if getattr(make, "memoised", False):
+            return True
+        if not isinstance(make, type) or not hasattr(make, "generate_sample"):
+            return False
+
+        def enumerator(block):
+            active = getattr(_draw, "active", None)
+            if active is None or active[0] is not block:
+                return make(block)
+            memo = active[1]
+            if "enumerator" not in memo:
+                memo["enumerator"] = make(block)
+                memo["built"] = memo.get("built", 0) + 1
+            return memo["enumerator"]
+
+        enumerator.memoised = True
+        random_gen.UCSolutionEnumerator = enumerator
+    return True
+
+
+@contextlib.contextmanager
+def _counted_once(block: Block, memo: Dict[str, Any], gen: Any):
+    """
+    Let ``RandomGen`` reuse the solution enumerator of *block* across
+    calls within this context; ``memo["built"]`` counts how often it was
+    built.  Other strategies, and SweetPea versions without the hook,
+    run unchanged.
+
+    >>> from mate_structure.sweetpea.builder.block import experimental_design_block
+    >>> block = experimental_design_block({"factors": [
+    ...     {"name": "color", "levels": [{"name": "red"}, {"name": "blue"}]}], "crossing": [["color"]]})
+    >>> memo = {}
+    >>> for _ in range(3):
+    ...     with _counted_once(block, memo, sweetpea.RandomGen):
+    ...         _ = synthesize(block, 2)
+    >>> memo["built"]
+    1
+    """
+    reuse = (isinstance(gen, type) and issubclass(gen, sweetpea.RandomGen)
+             and _enumerator_hook())
+    if not reuse:
+        yield
+        return
+    saved = getattr(_draw, "active", None)
+    _draw.active = (block, memo)
+    try:
+        yield
+    finally:
+        _draw.active = saved
+
+
+def draw_sequences(
+    design: dict | Block,
+    count: int | None = None,
+    *,
+    strategy: Any = "RandomGen",
+    seed: int | None = None,
+    minimum_trials: int = 1,
+    batch: int = 16,
+) -> Iterator[dict]:
+    """
+    Yield *count* sequences (endless with None) of one design, lazily.
+
+    The block is built once; with ``RandomGen`` on the SweetPea versions
+    in ``ENUMERATOR_VERSIONS`` its solution counting (nearly all of a
+    call) is done once as well.  Other strategies have no way to reuse
+    an encoding and redo their set-up for every batch.  Sequences are drawn *batch* at
+    a time, so memory stays flat however many are taken.
+    Sequences are distinct within a batch, not across batches.  With a
+    *seed* the stream is reproducible, whatever else uses ``random``
+    between draws.  Stops early if the design has no (more) sequences.
+
+    Examples:
+        >>> design = {"factors": [{"name": "color", "levels": [{"name": "red"}, {"name": "blue"}]}],
+        ...           "crossing": [["color"]]}
+        >>> seqs = list(draw_sequences(design, 3, seed=1))
+        >>> len(seqs), sorted(seqs[0]["color"])
+        (3, ['blue', 'red'])
+        >>> seqs == list(draw_sequences(design, 3, seed=1))
+        True
+    """
+    block = experimental_design_block(design, minimum_trials) if isinstance(design, dict) else design
+    gen = sampling_strategy(strategy)
+    stream = _Stream(seed)
+    memo: Dict[str, Any] = {}
+    drawn = 0
+    while count is None or drawn < count:
+        n = batch if count is None else min(batch, count - drawn)
+        with _counted_once(block, memo, gen), stream.active():
+            sequences = synthesize(block, n, gen)
+        if not sequences:
+            return
+        yield from sequences
+        drawn += len(sequences)
+
+
+# --------------------------------------------------------------------
+# many synthesis tasks, one process each, with a hard time limit
+# --------------------------------------------------------------------
+@dataclass(frozen=True)
+class SynthesisTask:
+    """
+    Sequences to synthesize for one design.
+
+    seed: fixed seed of this task; ``None`` → the runner's seed + task index
+
+    *minimum_trials* and *strategy* may be ``"auto"`` (see
+    :func:`choose_parameters`).
+    """
+    design: dict
+    samples: int = 1
+    minimum_trials: int | str = 1
+    strategy: str = "RandomGen"
+    seed: int | None = None
+
+
+def split_task(task: SynthesisTask, per_task: int) -> List[SynthesisTask]:
+    """
+    Spread the samples of *task* over tasks of at most *per_task* each,
+    so that one design's sequences run in parallel.
+
+    >>> [t.samples for t in split_task(SynthesisTask({}, samples=5), 2)]
+    [2, 2, 1]
+    """
+    return [SynthesisTask(task.design, min(per_task, task.samples - start),
+                          task.minimum_trials, task.strategy,
+                          None if task.seed is None else task.seed + start)
+            for start in range(0, task.samples, per_task)]
+
+
+def _run_task(conn, task: SynthesisTask, seed: int) -> None:
+    seed_all(seed)
+    params = {"minimum_trials": task.minimum_trials, "strategy": task.strategy, "reasons": []}
+    try:
+        if AUTO in (task.minimum_trials, task.strategy):
+            chosen = choose_parameters(task.design, task.minimum_trials,
+                                       task.strategy, task.samples)
+            params = {"minimum_trials": chosen.minimum_trials, "strategy": chosen.strategy,
+                      "reasons": chosen.reasons}
+        block = experimental_design_block(task.design, params["minimum_trials"])
+        sequences = synthesize(block, task.samples, params["strategy"])
+        conn.send({"status": "ok" if sequences else "unsat", "parameters": params,
+                   "sequences": sequences, "error": None})
+    except Exception as err:
+        conn.send({"status": "error", "parameters": params, "sequences": [],
+                   "error": f"{type(err).__name__}: {err}"})
+    finally:
+        conn.close()
+
+
+def iter_synthesis(
+    tasks: Iterable[SynthesisTask],
+    *,
+    workers: int | None = None,
+    timeout: float | None = None,
+    seed: int = 0,
+) -> Iterator[dict]:
+    """
+    Run every task in its own process, *workers* at a time, and yield
+    one record per task as it finishes.
+
+    A task still running after *timeout* seconds is killed.  Each record
+    holds the task ``index``, its ``seed``, ``status`` (``ok``, ``unsat``
+    when SweetPea finds no sequence, ``timeout`` or ``error``), the
+    ``seconds`` it took, the ``parameters`` it ran with (and why, when
+    they were ``"auto"``), the ``sequences`` and the ``error``.  A task
+    always gets the same seed (its own, else *seed* + index), so reruns
+    give the same sequences whatever the worker count.
+    """
+    ctx = multiprocessing.get_context()
+    workers = workers or os.cpu_count() or 1
+    queue = iter(enumerate(tasks))
+    running: Dict[Any, tuple] = {}          # conn -> (index, seed, process, start)
+
+    def record(index, task_seed, start, status, sequences=(), error=None, parameters=None) -> dict:
+        return {"index": index, "seed": task_seed, "status": status,
+                "seconds": time.monotonic() - start, "parameters": parameters,
+                "sequences": list(sequences), "error": error}
+
+    while True:
+        while len(running) < workers:
+            item = next(queue, None)
+            if item is None:
+                break
+            index, task = item
+            task_seed = task.seed if task.seed is not None else seed + index
+            recv, send = ctx.Pipe(duplex=False)
+            process = ctx.Process(target=_run_task, args=(send, task, task_seed), daemon=True)
+            process.start()
+            send.close()
+            running[recv] = (index, task_seed, process, time.monotonic())
+        if not running:
+            return
+
+        now = time.monotonic()
+        left = None
+        if timeout is not None:
+            left = max(0.0, min(start + timeout for *_, start in running.values()) - now)
+        for conn in wait(list(running), timeout=left):
+            index, task_seed, process, start = running.pop(conn)
+            try:
+                result = conn.recv()
+            except EOFError:                # died without a result
+                process.join()
+                yield record(index, task_seed, start, "error",
+                             error=f"Worker exited with code {process.exitcode}")
+                continue
+            finally:
+                conn.close()
+            process.join()
+            yield record(index, task_seed, start, result["status"],
+                         result["sequences"], result["error"], result["parameters"])
+
+        if timeout is not None:
+            now = time.monotonic()
+            for conn, (index, task_seed, process, start) in list(running.items()):
+                if now - start >= timeout:
+                    process.kill()
+                    process.join()
+                    conn.close()
+                    del running[conn]
+                    yield record(index, task_seed, start, "timeout")
+
+
+def run_synthesis(
+    tasks: Iterable[SynthesisTask],
+    dst: str | os.PathLike,
+    **run_kw,
+) -> Dict[str, int]:
+    """
+    :func:`iter_synthesis` into the JSONL file *dst*, one line per task,
+    written (and flushed) as each task finishes.
+
+    Returns the number of tasks per status.
+    """
+    counts = {"ok": 0, "unsat": 0, "timeout": 0, "error": 0}
+    with open(dst, "w") as out:
+        for result in iter_synthesis(tasks, **run_kw):
+            counts[result["status"]] += 1
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+    return counts
@@ -1,14 +1,27 @@
 # expr_rule.py
 from mate_strategy.rules import Rule
-import re
+
+from mate_structure.sweetpea.builder.expr import parse_expr
 
 # --------------------------------------------------------------------
 # helpers
 # --------------------------------------------------------------------
-_index_pattern = re.compile(r"\[[^\]]+\]")      # anything like [0], [-1], [ i ]
-
 def _has_indexing(expr: str) -> bool:
-    return bool(_index_pattern.search(expr))
+    """True if *expr* references a trial offset like [0], [-1], …"""
+    return parse_expr(expr).indexed
+
+
+def _has_subscript(expr: str) -> bool:
+    """True if *expr* has any ``[...]`` subscript, offset or not."""
+    return parse_expr(expr).has_subscript
+
+
+def _parses(expr: str) -> bool:
+    try:
+        parse_expr(expr)
+    except ValueError:
+        return False
+    return True
 
 
 # --------------------------------------------------------------------
@@ -32,7 +45,8 @@ class WithinExpr(Rule):
         return (
             isinstance(v, str)
             and bool(v.strip())
-            and not _has_indexing(v)     # forbid [...], [-1], etc.
+            and _parses(v)
+            and not _has_subscript(v)    # forbid [...], [-1], color[i], etc.
         )
 
 
@@ -58,5 +72,6 @@ class WindowExpr(Rule):
         return (
             isinstance(v, str)
             and bool(v.strip())
+            and _parses(v)
             and _has_indexing(v)         # must contain at least one [...]
         )
@@ -0,0 +1,264 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Dict, List, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from mate_structure.sweetpea.builder.expr import parse_expr
+from mate_structure.sweetpea.utils.convert import derive_levels, is_regular, is_window, to_canonical
+from mate_structure.sweetpea.utils.convert.lookup import MAX_CELLS, encode
+
+# ════════════════════════════════════════════════════════════════════
+# design-balance audit of synthesized sequences
+#
+# A crossing asks every combination of its factors' levels to appear
+# in proportion to the product of the level weights.  Combinations the
+# derived levels rule out (``grey`` & ``congruent``) are not part of
+# it.  Observed counts of all sequences come from one ``bincount`` of
+# (sequence, cell) codes.
+# ════════════════════════════════════════════════════════════════════
+def level_weights(factor: dict) -> np.ndarray:
+    """Weight of each level, in design order (missing weight → 1)."""
+    return np.array([lv.get("weight") or 1 for lv in factor["levels"]], dtype=np.float64)
+
+
+def _roots(name: str, by_name: Dict[str, dict], roots: Set[str]) -> bool:
+    """
+    Collect the factors *name* is a within-trial function of: regular
+    and window factors count as free.  False if it reads a column
+    that is not a factor.
+    """
+    f = by_name[name]
+    if is_regular(f) or is_window(f):
+        roots.add(name)
+        return True
+    refs = {ref for lv in f["levels"] for ref, _ in parse_expr(lv["expr"]).refs}
+    return all(ref in by_name and _roots(ref, by_name, roots) for ref in refs)
+
+
+def feasible_cells(factors: List[dict], crossing: List[str],
+                   max_cells: int = MAX_CELLS, complete: bool = False) -> np.ndarray:
+    """
+    Mask over all level combinations of *crossing* (mixed-radix order)
+    of those some trial can reach.  With *complete*, a trial must also
+    have a level of every other derived factor of the same roots.
+
+    Examples:
+        >>> fs = [{"name": "color", "levels": [{"name": "red"}, {"name": "grey"}]},
+        ...       {"name": "word", "levels": [{"name": "red"}, {"name": "blue"}]},
+        ...       {"name": "con", "levels": [{"name": "yes", "expr": "color==word"},
+        ...                                  {"name": "no", "expr": "color!=word and color!='grey'"},
+        ...                                  {"name": "neutral", "expr": "color=='grey'"}]}]
+        >>> feasible_cells(fs, ["color", "con"]).reshape(2, 3).tolist()
+        [[True, True, False], [False, False, True]]
+        >>> fs[2]["levels"].pop()
+        {'name': 'neutral', 'expr': "color=='grey'"}
+        >>> feasible_cells(fs, ["color", "word"], complete=True).reshape(2, 2).tolist()
+        [[True, True], [False, False]]
+    """
+    by_name = {f["name"]: f for f in factors}
+    sizes = [len(by_name[c]["levels"]) for c in crossing]
+    everything = np.ones(int(np.prod(sizes)), dtype=bool)
+
+    roots: Set[str] = set()
+    if not all(_roots(c, by_name, roots) for c in crossing):
+        return everything                       # reads plain data columns
+    roots_l = sorted(roots)
+    root_sizes = [len(by_name[r]["levels"]) for r in roots_l]
+    grid_n = int(np.prod(root_sizes, dtype=np.float64))
+    if grid_n > max_cells:
+        return everything
+
+    # every combination of the roots, as if they were regular factors
+    grid = np.indices(root_sizes).reshape(len(roots_l), grid_n)
+    inputs = pd.DataFrame({
+        r: pd.Categorical.from_codes(grid[a], [lv["name"] for lv in by_name[r]["levels"]])
+        for a, r in enumerate(roots_l)
+    })
+    within = [{"name": r, "levels": [{"name": lv["name"]} for lv in by_name[r]["levels"]]}
+              for r in roots_l]
+    for f in factors:
+        below: Set[str] = set()
+        if (f["name"] not in roots and _roots(f["name"], by_name, below)
+                and below <= roots):
+            within.append(f)
+    derived = derive_levels(inputs, within)
+
+    key = np.zeros(grid_n, dtype=np.int64)
+    ok = np.ones(grid_n, dtype=bool)
+    if complete:
+        for f in within[len(roots_l):]:
+            ok &= derived[f["name"]] < len(f["levels"])
+    for c, size in zip(crossing, sizes):
+        codes = inputs[c].cat.codes.to_numpy() if c in roots else derived[c]
+        ok &= codes < size                      # derived: no level matched
+        key = key * size + codes
+    mask = np.zeros_like(everything)
+    mask[key[ok]] = True
+    return mask
+
+
+@dataclass
+class CrossingAudit:
+    """
+    Expected against observed counts of one crossing, per sequence.
+
+    cells:      reachable level combinations, in design order
+    weights:    design weight of each cell
+    sequences:  sequence ids, one row of ``observed`` / ``expected`` each
+    observed:   ``(sequences, cells)`` counts
+    unexpected: per sequence, trials in combinations the design rules out
+
+    Only trials where every factor of the crossing has a level count
+    (windows start late).  A sequence of ``n`` such trials expects
+    ``n · weight / sum(weights)`` of each cell.
+    """
+    crossing: Tuple[str, ...]
+    cells: List[Tuple[str, ...]]
+    weights: np.ndarray
+    sequences: pd.Index
+    observed: np.ndarray
+    unexpected: np.ndarray
+
+    @property
+    def n(self) -> np.ndarray:
+        return self.observed.sum(axis=1) + self.unexpected
+
+    @property
+    def expected(self) -> np.ndarray:
+        if not len(self.cells):
+            return np.zeros_like(self.observed, dtype=np.float64)
+        return self.n[:, None] * (self.weights / self.weights.sum())[None, :]
+
+    @property
+    def dof(self) -> int:
+        return max(len(self.cells) - 1, 0)
+
+    @property
+    def chi2(self) -> np.ndarray:
+        """Pearson's chi-square of each sequence against the design."""
+        expected = self.expected
+        with np.errstate(divide="ignore", invalid="ignore"):
+            terms = (self.observed - expected) ** 2 / expected
+        return np.where(expected > 0, terms, 0.0).sum(axis=1)
+
+    @property
+    def max_deviation(self) -> np.ndarray:
+        """Largest ``|observed - expected|`` over the cells of each sequence."""
+        diff = np.abs(self.observed - self.expected)
+        return diff.max(axis=1, initial=0.0)
+
+    def to_frame(self) -> pd.DataFrame:
+        """One row per sequence: ``n``, ``chi2``, ``dof``, ``max_deviation``, ``unexpected``."""
+        return pd.DataFrame({
+            "n": self.n,
+            "chi2": self.chi2,
+            "dof": self.dof,
+            "max_deviation": self.max_deviation,
+            "unexpected": self.unexpected,
+        }, index=self.sequences)
+
+    def cell_frame(self) -> pd.DataFrame:
+        """Long format: one row per (sequence, cell) with ``expected`` and ``observed``."""
+        s, c = len(self.sequences), len(self.cells)
+        cells = pd.DataFrame(self.cells, columns=list(self.crossing))
+        frame = cells.iloc[np.tile(np.arange(c), s)].reset_index(drop=True)
+        frame.insert(0, self.sequences.name or "sequence", np.repeat(self.sequences, c))
+        frame["expected"] = self.expected.ravel()
+        frame["observed"] = self.observed.ravel()
+        return frame
+
+
+def audit(
+    design: dict,
+    df: pd.DataFrame,
+    *,
+    sequence: str | None = "sequence",
+) -> Dict[Tuple[str, ...], CrossingAudit]:
+    """
+    Check many synthesized sequences against the balance their design asks for.
+
+    Parameters
+    ----------
+    design : dict
+        An ``ExperimentSchema`` dict (``factors`` and ``crossing``).
+    df : DataFrame
+        Long format: one row per trial, a *sequence* column and one
+        column per factor.  Derived factors that are missing are added
+        with :func:`to_canonical`, per sequence.
+    sequence : str | None, default "sequence"
+        Column telling the sequences apart; None for a single one.
+
+    Returns
+    -------
+    dict
+        One :class:`CrossingAudit` per crossing, keyed by its factor tuple.
+
+    Examples:
+        >>> design = {"factors": [
+        ...     {"name": "color", "levels": [{"name": "red"}, {"name": "blue", "weight": 2}]},
+        ...     {"name": "size", "levels": [{"name": "big"}, {"name": "small"}]}],
+        ...     "crossing": [["color", "size"]]}
+        >>> df = pd.DataFrame({"sequence": [0] * 6 + [1] * 6,
+        ...                    "color": ["red", "blue", "blue"] * 2 + ["blue"] * 6,
+        ...                    "size": ["big"] * 3 + ["small"] * 3 + ["big", "small"] * 3})
+        >>> a = audit(design, df)[("color", "size")]
+        >>> a.cells
+        [('red', 'big'), ('red', 'small'), ('blue', 'big'), ('blue', 'small')]
+        >>> a.observed.tolist()
+        [[1, 1, 2, 2], [0, 0, 3, 3]]
+        >>> a.chi2.tolist(), a.max_deviation.tolist()
+        ([0.0, 3.0], [0.0, 1.0])
+
+        A flat crossing is one full crossing:
+
+        >>> list(audit({**design, "crossing": ["color"]}, df))
+        [('color',)]
+    """
+    factors = design["factors"]
+    by_name = {f["name"]: f for f in factors}
+    crossing = design["crossing"]
+    blocks = [crossing] if crossing and isinstance(crossing[0], str) else crossing
+    needed = {c for block in blocks for c in block}
+    if any(c not in df.columns for c in needed):
+        df = to_canonical(df, factors, group_by=sequence)
+
+    if sequence is None:
+        seq, ids = np.zeros(len(df), dtype=np.int64), pd.Index([0], name="sequence")
+    else:
+        seq, ids = pd.factorize(df[sequence], sort=True)
+        ids = pd.Index(ids, name=sequence)
+    n_seq = len(ids)
+
+    audits: Dict[Tuple[str, ...], CrossingAudit] = {}
+    for block in blocks:
+        crossing = tuple(block)
+        levels = [[lv["name"] for lv in by_name[c]["levels"]] for c in crossing]
+        sizes = [len(lv) for lv in levels]
+
+        # mixed-radix cell key of every trial
+        key = np.zeros(len(df), dtype=np.int64)
+        valid = seq >= 0
+        weight = np.ones(1)
+        for c, names in zip(crossing, levels):
+            codes = encode(np.asarray(df[c], dtype=object), names).astype(np.int64)
+            valid &= codes >= 0
+            key = key * len(names) + codes
+            weight = np.multiply.outer(weight, level_weights(by_name[c])).ravel()
+
+        mask = feasible_cells(factors, list(crossing))
+        position = np.where(mask, np.cumsum(mask) - 1, -1)
+        cell = np.where(valid, position[np.where(valid, key, 0)], -1)
+        n_cells = int(mask.sum())
+
+        hit = cell >= 0
+        observed = np.bincount(seq[hit] * n_cells + cell[hit],
+                               minlength=n_seq * n_cells).reshape(n_seq, n_cells)
+        unexpected = np.bincount(seq[valid & ~hit], minlength=n_seq)
+        combos = np.indices(sizes).reshape(len(sizes), -1)[:, mask]
+        cells = [tuple(names[i] for names, i in zip(levels, combo)) for combo in combos.T]
+        audits[crossing] = CrossingAudit(crossing, cells, weight[mask], ids,
+                                         observed, unexpected)
+    return audits
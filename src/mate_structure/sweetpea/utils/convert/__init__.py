@@ -1,10 +1,21 @@
 # file: sweetpea_dep_sort.py
 from __future__ import annotations
 
-import ast, re, pandas as pd
+import numpy as np
+import pandas as pd
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
 from typing import Dict, List, Set, Any
 
-from mate_structure.sweetpea.builder.expr import build_within, build_window
+from mate_structure.sweetpea.builder.expr import parse_expr
+from mate_structure.sweetpea.utils.convert.backend import (
+    FactorColumn, factorize, group_ids, resolve_backend,
+)
+from mate_structure.sweetpea.utils.convert.columnar import Columns, LevelDiagnostics, derive_codes
+from mate_structure.sweetpea.utils.convert.lookup import (
+    MAX_CELLS, Codes, build_table, code_dtype, factor_domain,
+)
 
 # ════════════════════════════════════════════════════════════════════
 # utilities for detecting regular / derived kinds
@@ -13,191 +24,474 @@ def is_regular(factor: dict) -> bool:
     return all("expr" not in lv for lv in factor["levels"])
 
 def is_window(factor: dict) -> bool:
-    return any("[-" in lv.get("expr", "") for lv in factor["levels"])
+    return any(parse_expr(lv["expr"]).width > 1
+               for lv in factor["levels"] if "expr" in lv)
 
 # ════════════════════════════════════════════════════════════════════
-# 1 · topological order of factors (unchanged from earlier)
+# 1 · topological order of factors, in dependency waves
 # ════════════════════════════════════════════════════════════════════
-def topo_sort_factors(factors: List[dict]) -> List[dict]:
-    name2factor = {f["name"]: f for f in factors}
-    deps: Dict[str, Set[str]] = {n: set() for n in name2factor}
-
+def factor_deps(factors: List[dict]) -> Dict[str, Set[str]]:
+    """Other factors each factor's level exprs reference."""
+    names = {f["name"] for f in factors}
+    deps: Dict[str, Set[str]] = {f["name"]: set() for f in factors}
     for f in factors:
         n = f["name"]
         for lv in f["levels"]:
             if "expr" not in lv:
                 continue
-            expr = lv["expr"]
-            if "[-" in expr:
-                _, _, base, _ = build_window(expr)
-            else:
-                _, _, base, _ = build_within(expr)
-            deps[n].update(b for b in base if b in name2factor and b != n)
+            base = parse_expr(lv["expr"]).variables
+            deps[n].update(b for b in base if b in names and b != n)
+    return deps
+
 
+def dependency_waves(factors: List[dict]) -> List[List[str]]:
+    """
+    Factor names grouped by dependency depth: wave 0 depends on no other
+    factor, wave *k* only on waves before it.  Factors of one wave can
+    be evaluated at the same time.
+
+    >>> dependency_waves([
+    ...     {"name": "color", "levels": [{"name": "red"}]},
+    ...     {"name": "word", "levels": [{"name": "red"}]},
+    ...     {"name": "congruent", "levels": [{"name": "y", "expr": "color==word"}]},
+    ...     {"name": "repeat", "levels": [{"name": "y", "expr": "color[-1]==color[0]"}]},
+    ...     {"name": "transition", "levels": [{"name": "y", "expr": "congruent[-1]==congruent[0]"}]},
+    ... ])
+    [['color', 'word'], ['congruent', 'repeat'], ['transition']]
+    """
+    deps = factor_deps(factors)
+    waves = [[n for n, d in deps.items() if not d]]
+    resolved = set(waves[0])
     waiting = {n: d for n, d in deps.items() if d}
-    ordered = [n for n, d in deps.items() if not d]
-    resolved = set(ordered)
 
     while waiting:
         ready = [n for n, d in waiting.items() if d <= resolved]
         if not ready:
             raise ValueError("Cyclic dependency among derived factors: "
                              + ", ".join(waiting))
+        waves.append(ready)
+        resolved.update(ready)
         for n in ready:
-            ordered.append(n)
-            resolved.add(n)
             waiting.pop(n)
+    return waves
 
-    for n in name2factor:
-        if n not in ordered:
-            ordered.insert(0, n)
-    return [name2factor[n] for n in ordered]
+
+def topo_sort_factors(factors: List[dict]) -> List[dict]:
+    name2factor = {f["name"]: f for f in factors}
+    return [name2factor[n] for wave in dependency_waves(factors) for n in wave]
+
+
+def critical_path(factors: List[dict], seconds: Dict[str, float]) -> List[str]:
+    """
+    The chain of dependent factors with the largest summed *seconds* –
+    the lower bound on wall time however many workers run a wave.
+    Factors without timing (regular ones) are left out.
+    """
+    deps = factor_deps(factors)
+    best: Dict[str, tuple] = {}                 # name -> (total, path)
+    for wave in dependency_waves(factors):
+        for n in wave:
+            prev = max((best[d] for d in deps[n]), default=(0.0, []))
+            best[n] = (prev[0] + seconds[n], prev[1] + [n]) if n in seconds else prev
+    return max(best.values(), default=(0.0, []))[1]
 
 # ════════════════════════════════════════════════════════════════════
-# 2 · token helpers for expression substitution
+# 2 · regular factors: level check and remap on factorized codes
 # ════════════════════════════════════════════════════════════════════
-_TOKEN_RE = re.compile(r"([A-Za-z_][A-Za-z0-9_]*)\s*\[(-?\d+)\]")
-_VAR_RE   = re.compile(r"\b([A-Za-z_][A-Za-z0-9_]*)\b")
-_PY_WORDS = {"and", "or", "not", "in", "is",
-             "True", "False", "None"}
+def _unique(values: list) -> list:
+    return list(pd.unique(np.asarray(values, dtype=object)))
 
-def _strip_strings(s: str) -> str:
-    """Return *s* with single- or double-quoted literals blanked out."""
-    return re.sub(r"(\"[^\"]*\"|'[^']*')", " ", s)
 
-def _compile_tokens(expr: str) -> list[tuple[str, str, int]]:
+def regular_codes(
+    values: pd.Series,
+    expected: List[str],
+    mapping: Dict[str, str] | None = None,
+    *,
+    partial: bool = False,
+) -> tuple[np.ndarray, Dict[Any, Any] | None]:
     """
-    Return **every** factor reference in *expr* as a list of
-    (token_string, base_name, index).
+    Level codes of a regular factor column (positions in *expected*)
+    and the value remap it needs – ``None`` if it already uses the
+    design's level names.
+
+    The column is factorized once; the explicit *mapping* and the
+    automatic 1-to-1 remap (sorted found → sorted expected, when the
+    number of levels agrees) are applied to its distinct values only.
+    With *partial* the column may show a subset of the levels and is
+    never auto-remapped (a chunk of a longer log).
 
-    * ``color[-1]`` → ('color[-1]', 'color', -1)
-    * ``color[0]``  → ('color[0]',  'color',  0)
-    * bare ``color`` (no brackets) is treated **exactly like** ``color[0]``.
     Examples:
-        >>> _compile_tokens("color[-1] and color[0]")
-        [('color[-1]', 'color', -1), ('color[0]', 'color', 0)]
+        >>> regular_codes(pd.Series(["b", "a", "b"]), ["a", "b"])
+        (array([1, 0, 1], dtype=int8), None)
+        >>> regular_codes(pd.Series([2, 1, 2]), ["lo", "hi"])
+        (array([0, 1, 0], dtype=int8), {2: 'lo', 1: 'hi'})
+        >>> regular_codes(pd.Series(["b", "b"]), ["a", "b"], partial=True)
+        (array([1, 1], dtype=int8), None)
+    """
+    return level_codes(*factorize(values), values.name, expected, mapping,
+                       partial=partial)
 
-        >>> _compile_tokens("'red' == word[-1]")
-        [('word[-1]', 'word', -1)]
 
-        >>> _compile_tokens('color[-1] == "green"')
-        [('color[-1]', 'color', -1)]
+def level_codes(
+    codes: np.ndarray,
+    uniques: np.ndarray,
+    name: str,
+    expected: List[str],
+    mapping: Dict[str, str] | None = None,
+    *,
+    partial: bool = False,
+) -> tuple[np.ndarray, Dict[Any, Any] | None]:
+    """:func:`regular_codes` of the factorized column *name*."""
+    source = uniques.tolist()
+    final  = list(source)
+    found  = source
+
+    # explicit user map
+    if mapping is not None:
+        final = [mapping.get(v, np.nan) for v in final]
+        found = _unique(final)
+
+    if partial:
+        if not set(found) <= set(expected):
+            raise ValueError(f"Levels in '{name}' {found} "
+                             f"are not all in design {expected}")
+    # automatic 1-to-1 if sizes equal
+    elif set(found) != set(expected) and len(found) == len(expected):
+        auto_map = {src: dst for src, dst in zip(sorted(found),
+                                                 sorted(expected))}
+        final = [auto_map.get(v, np.nan) for v in final]
+        found = _unique(final)
+
+    if not partial and set(found) != set(expected):
+        raise ValueError(f"Levels in '{name}' {found} "
+                         f"do not match design {expected}")
+
+    lut = pd.Index(expected, dtype=object).get_indexer(final)
+    lut = lut.astype(code_dtype(len(expected)))
+    remap = None if final == source else dict(zip(source, final))
+    return lut[codes], remap
 
+
+# ════════════════════════════════════════════════════════════════════
+# 3 · derived levels: lookup table, else column-wise
+# ════════════════════════════════════════════════════════════════════
+def _derive_factor(f, columns, codes, domains, n, seg, diagnose=False):
     """
-    tokens: list[tuple[str, str, int]] = []
-
-    # ① indexed tokens (from full expr) ------------------------------
-    indexed_bases = set()
-    for m in _TOKEN_RE.finditer(expr):
-        tok, base, idx = m.group(0), m.group(1), int(m.group(2))
-        tokens.append((tok, base, idx))
-        indexed_bases.add(base)
-
-    # ② bare variables (scan *without* string literals) --------------
-    for var in _VAR_RE.findall(_strip_strings(expr)):
-        if var in _PY_WORDS or var in indexed_bases:
-            continue
-        tokens.append((var, var, 0))
-
-    # longest tokens first → safe replacement order
-    tokens.sort(key=lambda t: -len(t[0]))
-    return tokens
-
-def _evaluate_expr(
-    expr: str,
-    current_idx: int,
-    df: pd.DataFrame,
-    factor_names: set[str]
-) -> bool:
-    """
-    Replace every occurrence of <factor>[k] or bare <factor> with its
-    literal value and eval the resulting Python expression.
+    Level codes of one derived factor, the seconds it took and, with
+    *diagnose*, its :class:`LevelDiagnostics`.
     """
-    expr_sub = expr
+    start   = time.perf_counter()
+    name    = f["name"]
+    parents = {k: v for k, v in domains.items() if k != name}
+    table   = build_table(f["levels"], parents, max_cells=min(MAX_CELLS, n))
+    check   = LevelDiagnostics.empty(n, len(f["levels"])) if diagnose else None
+    if table is not None:
+        out = table.gather(codes, domains, n, seg, check)
+    else:
+        out = derive_codes(f["levels"], columns, n, seg, check)
+        out = out.astype(code_dtype(len(domains[name])))
+    return out, time.perf_counter() - start, check
+
+
+_shared: tuple = ()                     # read-only state of a wave's workers
+
+
+def _share(*state):
+    global _shared
+    _shared = state
+
+
+def _derive_shared(f):
+    return _derive_factor(f, *_shared)
+
 
-    # ① window tokens --------------------------------------------------
-    for tok, base, idx in _compile_tokens(expr):
-        _idx = current_idx + idx
-        if _idx < 0 or _idx >= len(df):
-            return None
-        val = df[base][_idx]
-        lit = repr(val) if isinstance(val, str) else str(val)
-        expr_sub = expr_sub.replace(tok, lit)
+def _diagnose(out: Dict[str, Any], checks: Dict[str, LevelDiagnostics]) -> None:
+    out.update(matches={name: c.matches for name, c in checks.items()},
+               errors={name: c.errors for name, c in checks.items()},
+               edge={name: c.edge for name, c in checks.items()},
+               summary={name: c.summary() for name, c in checks.items()})
 
 
-    try:
-        return bool(eval(expr_sub))
-    except Exception:
-        return False
+def _rows(inputs: pd.DataFrame | Dict[str, Any]) -> int:
+    if isinstance(inputs, pd.DataFrame):
+        return len(inputs)
+    return len(next(iter(inputs.values()), ()))
+
+
+def derive_levels(
+    inputs: pd.DataFrame | Dict[str, Any],
+    factors: List[dict],
+    seg: np.ndarray | None = None,
+    *,
+    factor_workers: int | None = None,
+    factor_pool: str = "thread",
+    profile: Dict[str, Any] | None = None,
+    diagnostics: Dict[str, Any] | None = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Level codes of every derived factor (``len(levels)`` where no level
+    matches), evaluated in dependency waves.
+
+    *inputs* (a DataFrame or a dict of column arrays) holds each regular
+    factor as a ``Categorical`` in the design's level order plus any
+    other column the exprs read.  Windows
+    never reach across a change of the *seg* label (subject, session, …).
+
+    With *factor_workers* the derived factors of one wave run at the same
+    time on a ``"thread"`` or ``"process"`` pool; they only read the
+    columns of earlier waves.  A *profile* dict receives the ``waves``,
+    the ``seconds`` spent per factor and the ``critical_path``.
+
+    A *diagnostics* dict receives, per derived factor, the rows' number
+    of ``matches`` (levels whose expr holds), the ``errors`` mask (some
+    expr raised) and the ``edge`` mask (some window cut off by the start
+    or end of the sequence or segment) – found while the levels are
+    evaluated, see :class:`LevelDiagnostics` – and their ``summary``.
+    """
+    ordered = topo_sort_factors(factors)
+    by_name = {f["name"]: f for f in ordered}
+    domains = {f["name"]: factor_domain(f, is_regular(f)) for f in ordered}
+    columns = Columns(inputs)
+    codes   = Codes(columns, domains)
+    n       = _rows(inputs)
+    for f in ordered:
+        if is_regular(f):
+            values = inputs[f["name"]]
+            codes[f["name"]] = np.asarray(getattr(values, "cat", values).codes)
+
+    waves   = [[by_name[name] for name in wave if not is_regular(by_name[name])]
+               for wave in dependency_waves(factors)]
+    waves   = [wave for wave in waves if wave]
+    seconds: Dict[str, float] = {}
+    derived: Dict[str, np.ndarray] = {}
+    checks: Dict[str, LevelDiagnostics] = {}
+    for wave in waves:
+        state = (columns, codes, domains, n, seg, diagnostics is not None)
+        if not factor_workers or factor_workers <= 1 or len(wave) < 2:
+            results = [_derive_factor(f, *state) for f in wave]
+        elif factor_pool == "process":
+            with ProcessPoolExecutor(min(factor_workers, len(wave)),
+                                     initializer=_share, initargs=state) as pool:
+                results = list(pool.map(_derive_shared, wave))
+        else:
+            with ThreadPoolExecutor(min(factor_workers, len(wave))) as pool:
+                results = list(pool.map(lambda f: _derive_factor(f, *state), wave))
+
+        for f, (out, took, check) in zip(wave, results):
+            name = f["name"]
+            derived[name] = codes[name] = out
+            columns.add_codes(name, out, domains[name])
+            seconds[name] = took
+            if check is not None:
+                checks[name] = check
+
+    if profile is not None:
+        profile.update(waves=[[f["name"] for f in wave] for wave in waves],
+                       seconds=seconds,
+                       critical_path=critical_path(factors, seconds))
+    if diagnostics is not None:
+        _diagnose(diagnostics, checks)
+    return derived
+
+
+def _derive_task(inputs, factors, seg, diagnose):
+    profile: Dict[str, Any] = {}
+    diagnostics: Dict[str, Any] | None = {} if diagnose else None
+    derived = derive_levels(inputs, factors, seg, profile=profile, diagnostics=diagnostics)
+    return derived, profile, diagnostics
+
+
+def _derive_grouped(
+    inputs: Dict[str, Any],
+    factors: List[dict],
+    groups: np.ndarray,
+    workers: int | None,
+    chunksize: int | None,
+    **derive_kw,
+) -> Dict[str, np.ndarray]:
+    """
+    :func:`derive_levels` with windows reset at every group, optionally
+    spread over a process pool (*chunksize* consecutive groups per task).
+    Results come back in the original row order.
+    """
+    order  = np.argsort(groups, kind="stable")
+    inputs = {c: v.take(order) for c, v in inputs.items()}
+    seg    = groups[order]
+    diagnostics = derive_kw.pop("diagnostics", None)
+    diagnose    = diagnostics is not None
+
+    if not workers or workers <= 1 or len(seg) == 0:
+        checks = [{} if diagnose else None]
+        parts  = [derive_levels(inputs, factors, seg, diagnostics=checks[0], **derive_kw)]
+    else:
+        starts = np.flatnonzero(np.diff(seg)) + 1
+        per    = chunksize or -(-(len(starts) + 1) // (4 * workers))
+        cuts   = [0, *starts[per - 1::per].tolist(), len(seg)]
+        bounds = list(zip(cuts[:-1], cuts[1:]))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            tasks = list(pool.map(_derive_task,
+                                  [{c: v[a:b] for c, v in inputs.items()}
+                                   for a, b in bounds],
+                                  repeat(factors),
+                                  [seg[a:b] for a, b in bounds],
+                                  repeat(diagnose)))
+        parts  = [derived for derived, _, _ in tasks]
+        checks = [check for _, _, check in tasks]
+
+        profile = derive_kw.get("profile")
+        if profile is not None:                 # seconds summed over tasks
+            seconds = {name: sum(p["seconds"][name] for _, p, _ in tasks)
+                       for name in tasks[0][1]["seconds"]}
+            profile.update(waves=tasks[0][1]["waves"], seconds=seconds,
+                           critical_path=critical_path(factors, seconds))
+
+    back = np.empty_like(order)                 # row i of df ← row back[i]
+    back[order] = np.arange(len(order))
+
+    def restore(pieces: List[np.ndarray]) -> np.ndarray:
+        return (pieces[0] if len(pieces) == 1 else np.concatenate(pieces)).take(back)
+
+    derived = {name: restore([p[name] for p in parts]) for name in parts[0]}
+    if diagnose:
+        _diagnose(diagnostics, {
+            name: LevelDiagnostics(*(restore([c[key][name] for c in checks])
+                                     for key in ("matches", "errors", "edge")))
+            for name in parts[0]})
+    return derived
+
 
 # ════════════════════════════════════════════════════════════════════
-# 3 · dataframe → canonical factors
+# 4 · dataframe → canonical factors
 # ════════════════════════════════════════════════════════════════════
 def to_canonical(
     df: pd.DataFrame,
     factors: List[dict],
     *,
     only_factors: bool = False,
-    map_regular: Dict[str, Dict[str, str]] | None = None
+    only_derived: bool = False,
+    copy: bool = True,
+    map_regular: Dict[str, Dict[str, str]] | None = None,
+    categorical: bool = False,
+    partial: bool = False,
+    group_by: str | List[str] | None = None,
+    workers: int | None = None,
+    chunksize: int | None = None,
+    factor_workers: int | None = None,
+    factor_pool: str = "thread",
+    profile: Dict[str, Any] | None = None,
+    diagnostics: Dict[str, Any] | None = None,
+    backend: str | None = None,
 ) -> pd.DataFrame:
-
+    """
+    Check the regular factor columns of *df* against the design and
+    add one column per derived factor.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Trial log, one row per trial, in trial order: a pandas or polars
+        (also lazy) frame, or a dict of column arrays.
+    factors : list of dict
+        Factor dicts as in ``ExperimentSchema.factors``.
+    only_factors : bool, default False
+        Return only the factor columns.
+    only_derived : bool, default False
+        Return only the derived factor columns, as a new table (with the
+        index of *df*, for pandas): nothing of *df* is copied and regular
+        columns are checked but never remapped.
+    copy : bool, default True
+        Copy the columns of *df* that the result keeps unchanged.  With
+        False they are shared with *df* – only the factor columns that
+        change are allocated.  *df* itself is never modified.
+    map_regular : dict, optional
+        ``{factor: {value_in_df: level_name}}`` for regular factors whose
+        values differ from the design's level names.
+    categorical : bool, default False
+        Store every factor column as a ``Categorical`` whose categories
+        follow the design's level order (rows without a derived level
+        are NaN).  Level checks and derived levels work on the codes.
+    partial : bool, default False
+        Accept regular columns that show only some of their levels (no
+        automatic remap) – for pieces of a longer log.
+    group_by : str or list of str, optional
+        Column(s) such as subject / session / block; every group is its
+        own trial sequence, so windows never reach into another group.
+        Levels are still checked (and remapped) over the whole frame.
+    workers : int, optional
+        With *group_by*: evaluate groups on a process pool this large.
+    chunksize : int, optional
+        With *workers*: groups per task (default: about four tasks per
+        worker).
+    factor_workers : int, optional
+        Evaluate the derived factors of one dependency wave (see
+        :func:`dependency_waves`) at the same time on a pool this large.
+    factor_pool : {"thread", "process"}, default "thread"
+        Kind of pool used with *factor_workers*.
+    profile : dict, optional
+        Filled with the wave schedule (``waves``), the ``seconds`` spent
+        per derived factor and the ``critical_path`` through them.
+    diagnostics : dict, optional
+        Filled, per derived factor and in the row order of *df*, with
+        the number of levels that hold (``matches``), the rows where an
+        expr raised (``errors``) or a window was cut off by the edge of
+        the sequence or group (``edge``), and the ``summary`` counts of
+        unmatched, ambiguous, error and edge rows (see
+        :class:`LevelDiagnostics`).  Found in the same pass that derives
+        the levels.
+    backend : {"pandas", "polars", "numpy"}, optional
+        Table type to work on (see :mod:`.backend`): by default the one of
+        *df*, else *df* is converted to it first.  The result is a table
+        of that type; its values are the same whatever the backend.  Only
+        the columns the design reads are taken out of *df* – a lazy
+        polars frame stays lazy, with the factor columns added to it.
+    """
+    if only_factors and only_derived:
+        raise ValueError("Use only_factors or only_derived, not both")
+    backend, df = resolve_backend(df, backend)
+    if categorical and not backend.categorical:
+        raise ValueError(f"The {backend.name} backend has no categorical columns")
     ordered = topo_sort_factors(factors)
-    df      = df.copy(deep=True)
+    domains = {f["name"]: factor_domain(f, is_regular(f)) for f in ordered}
+    regular = [f["name"] for f in ordered if is_regular(f)]
+
+    # ---------- columns the design reads -----------------------------
+    present = set(backend.names(df))
+    for col in regular:
+        if col not in present:
+            raise KeyError(f"Missing factor column '{col}'")
+    read = {name for f in ordered if not is_regular(f)
+            for lv in f["levels"] for name in parse_expr(lv["expr"]).variables}
+    read = sorted(read - set(domains) & present)
+    groups = [group_by] if isinstance(group_by, str) else list(group_by or [])
+    view = backend.select(df, list(dict.fromkeys(regular + read + groups)))
 
     # ---------- regular factor sanity / optional + AUTO remap --------
-    for f in ordered:
-        if is_regular(f):
-            col = f["name"]
-            if col not in df.columns:
-                raise KeyError(f"Missing factor column '{col}'")
-            expected = [lv["name"] for lv in f["levels"]]
-            found    = list(df[col].unique())
-
-            # explicit user map
-            if map_regular and col in map_regular:
-                df[col] = df[col].map(map_regular[col])
-                found   = list(df[col].unique())
-
-            # automatic 1-to-1 if sizes equal
-            if set(found) != set(expected) and len(found) == len(expected):
-                auto_map = {src: dst for src, dst in zip(sorted(found),
-                                                         sorted(expected))}
-                df[col] = df[col].map(auto_map)
-                found   = list(df[col].unique())
-
-            if set(found) != set(expected):
-                raise ValueError(f"Levels in '{col}' {found} "
-                                 f"do not match design {expected}")
-
-    # ---------- ensure derived columns exist -------------------------
-    for f in ordered:
-        if not is_regular(f) and f["name"] not in df.columns:
-            df[f["name"]] = None
-
-
-    factor_names = {f["name"] for f in factors}
-
-    # ---------- row-wise evaluation ----------------------------------
-    for f in ordered:
-        if is_regular(f):
-            continue
-        res = []
-        for idx, _ in df.iterrows():
-            is_skip = False
-            for lv in f["levels"]:
-
-                expr = lv["expr"]
-                if _evaluate_expr(expr, idx, df, factor_names):
-                    res.append(lv["name"])
-                    is_skip = True
-                    break
-            if not is_skip:
-                res.append(None)
-
-
-        df[f["name"]]= res
-
-
-    if only_factors:
-        df = df[[f["name"] for f in ordered]]
-    return df
+    inputs: Dict[str, Any] = {}
+    columns: Dict[str, FactorColumn] = {}
+    for col in regular:
+        codes, remap = level_codes(
+            *backend.factorize(view, col), col, domains[col],
+            (map_regular or {}).get(col), partial=partial)
+        inputs[col] = pd.Categorical.from_codes(codes, domains[col])
+        if (categorical or remap is not None) and not only_derived:
+            columns[col] = FactorColumn(domains[col], codes, categorical, remap)
+
+    # ---------- derived levels ---------------------------------------
+    inputs.update({c: backend.values(view, c) for c in read})
+
+    derive_kw = dict(factor_workers=factor_workers, factor_pool=factor_pool,
+                     profile=profile, diagnostics=diagnostics)
+    if group_by is None:
+        derived = derive_levels(inputs, factors, **derive_kw)
+    else:
+        derived = _derive_grouped(inputs, factors, group_ids(backend, view, groups),
+                                  workers, chunksize, **derive_kw)
+
+    for name, codes in derived.items():
+        none  = len(domains[name]) - 1
+        columns[name] = FactorColumn(domains[name][:-1],
+                                     np.where(codes == none, -1, codes), categorical)
+
+    only = ([f["name"] for f in ordered] if only_factors else
+            list(derived) if only_derived else None)
+    return backend.with_factors(df, columns, only, copy)
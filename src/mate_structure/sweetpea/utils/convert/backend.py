@@ -0,0 +1,328 @@
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any, Dict, List, Mapping, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from mate_structure.sweetpea.utils.convert.columnar import column_values
+
+# ════════════════════════════════════════════════════════════════════
+# dataframe backends
+#
+# The converter and the report work on NumPy level codes; a backend is
+# all they need from a table type: column names, plain value arrays,
+# codes of a column (``factorize``) and writing factor columns back.
+#   · pandas  – ``pd.DataFrame``
+#   · polars  – ``pl.DataFrame`` / ``pl.LazyFrame``; a lazy frame is
+#               collected for the columns a design reads only, and the
+#               factor columns are added to the lazy plan
+#   · numpy   – a mapping of column name → 1-d array
+# Polars is imported only when a polars frame is handled.  Missing
+# values come back as None (NaN in float columns).
+# ════════════════════════════════════════════════════════════════════
+Frame = Any
+
+
+def factorize(values) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Codes of *values* (a Series or array) in order of first appearance,
+    and the distinct values; a missing value counts as one of them and
+    is kept as it first appears (``None`` or NaN).
+
+    >>> factorize(np.array(["b", None, "a", "b"], dtype=object))
+    (array([0, 1, 2, 0]), array(['b', None, 'a'], dtype=object))
+    """
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    uniques = np.asarray(uniques)
+    missing = np.asarray(pd.isna(uniques))
+    if missing.any():
+        j = int(np.argmax(missing))
+        first = int(np.argmax(codes == j))
+        uniques = uniques.astype(object)
+        uniques[j] = values.iloc[first] if isinstance(values, pd.Series) else values[first]
+    return codes, uniques
+
+
+@dataclass
+class FactorColumn:
+    """
+    A factor column to write back.
+
+    codes:   per row, the index of its level in ``levels`` (``-1``: none)
+    remap:   for a regular column kept as values, the value → level map
+             it needs; the new values are taken from ``levels`` by code
+    """
+    levels: List[Any]
+    codes: np.ndarray
+    categorical: bool = False
+    remap: Dict[Any, Any] | None = None
+
+    def values(self) -> np.ndarray:
+        """Level names as an object array, ``None`` where no level."""
+        return np.asarray(self.levels + [None], dtype=object)[self.codes]
+
+
+class Backend(ABC):
+    """What the converter and the report use of a table type."""
+
+    name = ""
+    categorical = True          # can hold columns with a fixed level order
+
+    @abstractmethod
+    def accepts(self, frame: Frame) -> bool:
+        ...
+
+    @abstractmethod
+    def convert(self, frame: Frame) -> Frame:
+        """*frame* of another backend as this backend's table."""
+
+    @abstractmethod
+    def names(self, frame: Frame) -> List[str]:
+        ...
+
+    def select(self, frame: Frame, names: Sequence[str]) -> Frame:
+        """A table of the columns *names* that values can be read from."""
+        return frame
+
+    @abstractmethod
+    def rows(self, frame: Frame) -> int:
+        ...
+
+    @abstractmethod
+    def values(self, frame: Frame, name: str) -> np.ndarray:
+        """Column *name*: numeric / boolean arrays native, others object."""
+
+    @abstractmethod
+    def factorize(self, frame: Frame, name: str) -> Tuple[np.ndarray, np.ndarray]:
+        """:func:`factorize` of column *name*."""
+
+    def categories(self, frame: Frame, name: str) -> Tuple[np.ndarray, list] | None:
+        """Codes (``-1`` missing) and categories of a categorical column."""
+        return None
+
+    @abstractmethod
+    def with_factors(self, frame: Frame, columns: Dict[str, FactorColumn],
+                     only: List[str] | None = None, copy: bool = True) -> Frame:
+        """
+        *frame* with *columns* added or replaced (just the columns *only*,
+        if given).  *frame* itself is never modified; without *copy* the
+        result shares the columns it keeps with it.
+        """
+
+
+# ════════════════════════════════════════════════════════════════════
+# pandas
+# ════════════════════════════════════════════════════════════════════
+class PandasBackend(Backend):
+    name = "pandas"
+
+    def accepts(self, frame):
+        return isinstance(frame, pd.DataFrame)
+
+    def convert(self, frame):
+        if _is_polars(frame):
+            return _collect(frame).to_pandas()
+        return pd.DataFrame(dict(frame))
+
+    def names(self, frame):
+        return list(frame.columns)
+
+    def rows(self, frame):
+        return len(frame)
+
+    def values(self, frame, name):
+        return column_values(frame[name])
+
+    def factorize(self, frame, name):
+        return factorize(frame[name])
+
+    def categories(self, frame, name):
+        s = frame[name]
+        if not isinstance(s.dtype, pd.CategoricalDtype):
+            return None
+        return s.cat.codes.to_numpy(), s.cat.categories.tolist()
+
+    def with_factors(self, frame, columns, only=None, copy=True):
+        if only is not None:                    # CoW: selected, not copied
+            frame = frame[[c for c in only if c in frame.columns and c not in columns]]
+        df = frame.copy(deep=copy)
+        for name, col in columns.items():
+            if col.categorical:
+                df[name] = pd.Categorical.from_codes(col.codes, col.levels)
+            elif col.remap is not None:         # dtype as ``.map(remap)`` gives
+                df[name] = pd.Series(pd.Index(col.levels).take(col.codes), index=df.index)
+            else:
+                df[name] = pd.Series(col.values(), index=df.index, dtype=object)
+        return df[only] if only is not None else df
+
+
+# ════════════════════════════════════════════════════════════════════
+# polars
+# ════════════════════════════════════════════════════════════════════
+def _is_polars(frame) -> bool:
+    return type(frame).__module__.split(".")[0] == "polars"
+
+
+def _collect(frame):
+    return frame.collect() if type(frame).__name__ == "LazyFrame" else frame
+
+
+class PolarsBackend(Backend):
+    name = "polars"
+
+    def accepts(self, frame):
+        return _is_polars(frame) and type(frame).__name__ in ("DataFrame", "LazyFrame")
+
+    def convert(self, frame):
+        import polars as pl
+
+        if not isinstance(frame, pd.DataFrame):
+            return pl.DataFrame({k: np.asarray(v) for k, v in frame.items()})
+        out = pl.from_pandas(frame)
+        enums = {c: pl.Enum(frame[c].cat.categories.tolist()) for c in frame.columns
+                 if isinstance(frame[c].dtype, pd.CategoricalDtype)
+                 and all(isinstance(v, str) for v in frame[c].cat.categories)}
+        return out.cast(enums) if enums else out
+
+    def names(self, frame):
+        return frame.collect_schema().names()
+
+    def select(self, frame, names):
+        return _collect(frame.select(list(names)))
+
+    def rows(self, frame):
+        return frame.height
+
+    @staticmethod
+    def _plain(s):
+        import polars as pl
+
+        if isinstance(s.dtype, (pl.Enum, pl.Categorical)):
+            return s.cast(pl.String)
+        return s.fill_nan(None) if s.dtype.is_float() else s
+
+    def values(self, frame, name):
+        return column_values(self._plain(frame[name]).to_numpy())
+
+    def factorize(self, frame, name):
+        import polars as pl
+
+        s = frame[name]
+        # integer ids of the values (strings by hash, not sorted), with
+        # 0 for missing → order of first appearance
+        if isinstance(s.dtype, (pl.Enum, pl.Categorical)):
+            ids = s.to_physical() + 1
+        elif s.dtype == pl.String:
+            ids = s.cast(pl.Categorical).to_physical() + 1
+        else:
+            ids = self._plain(s).rank("dense")
+        rank = ids.fill_null(0).to_numpy().astype(np.int64)
+        first = ids.arg_unique().to_numpy()
+        appear = np.zeros(int(rank.max(initial=0)) + 1, dtype=np.int64)
+        appear[rank[first]] = np.arange(len(first))
+        uniques = self._plain(s.gather(first)).to_numpy()
+        if uniques.dtype.kind not in "biuf":
+            uniques = uniques.astype(object)
+        return appear[rank], uniques
+
+    def categories(self, frame, name):
+        import polars as pl
+
+        s = frame[name]
+        if not isinstance(s.dtype, pl.Enum):
+            return None
+        codes = s.to_physical().cast(pl.Int64).fill_null(-1).to_numpy()
+        return codes, s.dtype.categories.to_list()
+
+    def with_factors(self, frame, columns, only=None, copy=True):
+        import polars as pl
+
+        series = []
+        for name, col in columns.items():
+            dtype = pl.Enum(col.levels) if col.categorical else pl.String
+            levels = pl.Series(name, col.levels + [None], dtype=dtype)
+            series.append(levels.gather(np.where(col.codes < 0, len(col.levels), col.codes)))
+        out = frame.with_columns(series)
+        return out.select(only) if only is not None else out
+
+
+# ════════════════════════════════════════════════════════════════════
+# NumPy: a mapping of column name → array
+# ════════════════════════════════════════════════════════════════════
+class NumpyBackend(Backend):
+    name = "numpy"
+    categorical = False
+
+    def accepts(self, frame):
+        return isinstance(frame, Mapping)
+
+    def convert(self, frame):
+        frame = _collect(frame)
+        return {c: frame[c].to_numpy() for c in frame.columns}
+
+    def names(self, frame):
+        return list(frame)
+
+    def rows(self, frame):
+        return len(next(iter(frame.values()), ()))
+
+    def values(self, frame, name):
+        return column_values(frame[name])
+
+    def factorize(self, frame, name):
+        return factorize(np.asarray(frame[name]))
+
+    def categories(self, frame, name):
+        values = frame[name]
+        if not isinstance(values, pd.Categorical):
+            return None
+        return values.codes, values.categories.tolist()
+
+    def with_factors(self, frame, columns, only=None, copy=True):
+        if any(col.categorical for col in columns.values()):
+            raise ValueError("The numpy backend has no categorical columns")
+        keep = [c for c in (frame if only is None else only) if c in frame]
+        out = {c: None if c in columns else np.array(frame[c], copy=True) if copy else frame[c]
+               for c in keep}
+        for name, col in columns.items():
+            out[name] = col.values()
+        return {n: out[n] for n in only} if only is not None else out
+
+
+BACKENDS: Dict[str, Backend] = {
+    b.name: b for b in (PandasBackend(), PolarsBackend(), NumpyBackend())
+}
+
+
+def resolve_backend(frame: Frame, backend: str | Backend | None = None) -> Tuple[Backend, Frame]:
+    """
+    The backend named *backend* – or, by default, the one for the type
+    of *frame* – and *frame* as that backend's table.
+
+    >>> b, frame = resolve_backend(pd.DataFrame({"color": ["red"]}), "numpy")
+    >>> b.name, frame
+    ('numpy', {'color': array(['red'], dtype=object)})
+    """
+    if backend is None:
+        for b in BACKENDS.values():
+            if b.accepts(frame):
+                return b, frame
+        raise TypeError(f"No backend for {type(frame).__name__}: "
+                        f"use a pandas or polars frame or a mapping of arrays")
+    if isinstance(backend, str):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend!r}: use {', '.join(BACKENDS)}")
+        backend = BACKENDS[backend]
+    return backend, frame if backend.accepts(frame) else backend.convert(frame)
+
+
+def group_ids(backend: Backend, frame: Frame, keys: str | List[str]) -> np.ndarray:
+    """One integer label per row for each distinct combination of *keys*."""
+    ids = np.zeros(backend.rows(frame), dtype=np.int64)
+    for key in [keys] if isinstance(keys, str) else keys:
+        codes, uniques = backend.factorize(frame, key)
+        ids, _ = pd.factorize(ids * len(uniques) + codes)
+    return ids
@@ -0,0 +1,341 @@
+from __future__ import annotations
+
+import ast
+import copy
+from dataclasses import dataclass
+from functools import lru_cache, reduce
+from typing import Callable, Dict, List, Mapping
+
+import numpy as np
+import pandas as pd
+
+from mate_structure.sweetpea.builder.expr import ExprIR, lambda_code, parse_expr
+
+# ════════════════════════════════════════════════════════════════════
+# column-at-a-time evaluation of derived levels
+#
+# Every level ``expr`` is parsed once (``parse_expr``) and evaluated
+#   · by a vectorised function over whole columns (numpy element-wise
+#     ops, ``and`` / ``or`` / ``not`` become logical ops on boolean arrays)
+#   · by the scalar ``ExprIR.fn``, row by row, only when the vectorised
+#     form raises – a failing row then counts as ``False``.
+# ``color[-1]`` is a slice of the ``color`` column shifted by one row;
+# rows whose window runs past either edge never match.
+# ════════════════════════════════════════════════════════════════════
+_COMPARE_OPS = (ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE,
+                ast.In, ast.NotIn)
+_VECTOR_NODES = (ast.Expression, ast.BoolOp, ast.And, ast.Or,
+                 ast.UnaryOp, ast.Not, ast.USub, ast.UAdd,
+                 ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div,
+                 ast.FloorDiv, ast.Mod, ast.Pow,
+                 ast.Compare, *_COMPARE_OPS,
+                 ast.Name, ast.Load, ast.Constant, ast.Tuple, ast.List)
+
+
+class _Vectorise(ast.NodeTransformer):
+    """Rewrite boolean / membership logic into element-wise helper calls."""
+
+    @staticmethod
+    def _call(fn: str, args: List[ast.expr]) -> ast.Call:
+        return ast.Call(func=ast.Name(id=fn, ctx=ast.Load()),
+                        args=args, keywords=[])
+
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        fn = "__and" if isinstance(node.op, ast.And) else "__or"
+        return self._call(fn, node.values)
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Not):
+            return self._call("__not", [node.operand])
+        return node
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        parts, left = [], node.left
+        for op, right in zip(node.ops, node.comparators):
+            if isinstance(op, (ast.In, ast.NotIn)):
+                part = self._call("__isin", [left, right])
+                if isinstance(op, ast.NotIn):
+                    part = self._call("__not", [part])
+            else:
+                part = ast.Compare(left=left, ops=[op], comparators=[right])
+            parts.append(part)
+            left = right
+        return parts[0] if len(parts) == 1 else self._call("__and", parts)
+
+
+# ---------- element-wise helpers used by the vectorised code ---------
+def _box(x):
+    """0-d object array holding *x* (so tuples are not broadcast)."""
+    if isinstance(x, np.ndarray):
+        return x
+    out = np.empty((), dtype=object)
+    out[()] = x
+    return out
+
+
+def _truth(x) -> np.ndarray:
+    a = np.asarray(x)
+    if a.dtype == bool:
+        return a
+    if a.dtype.kind in "iuf":
+        return a != 0
+    return np.asarray(np.frompyfunc(bool, 1, 1)(_box(x)), dtype=bool)
+
+
+_HELPERS = {
+    "__and": lambda *xs: reduce(np.logical_and, map(_truth, xs)),
+    "__or": lambda *xs: reduce(np.logical_or, map(_truth, xs)),
+    "__not": lambda x: ~_truth(x),
+    "__isin": lambda a, b: np.asarray(
+        np.frompyfunc(lambda x, y: x in y, 2, 1)(_box(a), _box(b)),
+        dtype=bool),
+}
+
+
+def _vectorisable(body: ast.expr) -> bool:
+    for node in ast.walk(body):
+        if not isinstance(node, _VECTOR_NODES):
+            return False
+        if isinstance(node, (ast.Tuple, ast.List)) and not all(
+                isinstance(e, ast.Constant) for e in node.elts):
+            return False
+    return True
+
+
+@lru_cache(maxsize=4096)
+def vector_function(expr: str) -> Callable | None:
+    """
+    Element-wise version of ``parse_expr(expr).fn`` – or ``None`` when
+    the expression uses constructs (calls, attributes, ``is``, …) that
+    have no safe array equivalent.
+
+    Examples:
+        >>> fn = vector_function("color[-1]==color[0] and word!='red'")
+        >>> fn(np.array(['red', 'blue'], dtype=object),
+        ...    np.array(['red', 'red'], dtype=object),
+        ...    np.array(['blue', 'blue'], dtype=object))
+        array([ True, False])
+        >>> vector_function("color.startswith('r')") is None
+        True
+    """
+    ir = parse_expr(expr)
+    if not _vectorisable(ir.body):
+        return None
+    body = _Vectorise().visit(copy.deepcopy(ir.body))
+    return eval(lambda_code(body, len(ir.refs)), dict(_HELPERS))
+
+
+# ════════════════════════════════════════════════════════════════════
+# evaluation over columns
+# ════════════════════════════════════════════════════════════════════
+def column_values(s: pd.Series | np.ndarray) -> np.ndarray:
+    """Numeric / boolean columns stay native, everything else → object."""
+    arr = np.asarray(s)
+    if arr.dtype.kind not in "biuf":
+        arr = np.asarray(s, dtype=object)
+    return arr
+
+
+def _safe(fn: Callable, args) -> bool:
+    try:
+        return bool(fn(*args))
+    except Exception:
+        return False
+
+
+def evaluate(
+    expr: ExprIR,
+    args: List[np.ndarray],
+    m: int,
+    errors: np.ndarray | None = None,
+) -> np.ndarray:
+    """
+    Truth of *expr* with ``refs[i]`` bound to the column ``args[i]``
+    (all of length *m*).  Rows on which *expr* raises are False, and
+    are flagged in *errors* (a boolean array of length *m*) if given.
+    """
+    vector = vector_function(expr.text)
+    if vector is not None:
+        try:
+            with np.errstate(all="raise"):
+                hit = _truth(vector(*args))
+            return np.broadcast_to(hit, (m,))
+        except Exception:
+            pass                                # fall back to row-wise
+
+    rows = zip(*(a.tolist() for a in args)) if args else [()] * m
+    if errors is None:
+        return np.fromiter((_safe(expr.fn, vals) for vals in rows),
+                           dtype=bool, count=m)
+    hit = np.zeros(m, dtype=bool)
+    for i, vals in enumerate(rows):
+        try:
+            hit[i] = bool(expr.fn(*vals))
+        except Exception:
+            errors[i] = True
+    return hit
+
+
+def same_segment(seg: np.ndarray | None, lo: int, hi: int, offsets) -> np.ndarray | bool:
+    """
+    For rows ``lo … hi-1``: does every offset stay inside the row's own
+    segment (``seg`` labels, e.g. subject)?  ``True`` without segments.
+    """
+    shifts = {k for k in offsets if k}
+    if seg is None or not shifts:
+        return True
+    here = seg[lo:hi]
+    return np.logical_and.reduce([seg[lo + k:hi + k] == here for k in shifts])
+
+
+@dataclass
+class LevelDiagnostics:
+    """
+    How the levels of one derived factor held, row by row.
+
+    matches: number of levels whose expr holds (the first one is used)
+    errors:  evaluating some level raised (it then counts as not holding)
+    edge:    some level's window runs past the start or end of the
+             sequence (or of its group), so that level cannot hold
+
+    Examples:
+        >>> levels = [{"name": "slow", "expr": "rt > 500"},
+        ...           {"name": "slower", "expr": "rt > rt[-1]"}]
+        >>> d = LevelDiagnostics.empty(3, len(levels))
+        >>> derive_codes(levels, {"rt": np.array([600, 700, 300])}, 3, diagnosis=d)
+        array([0, 0, 2], dtype=int32)
+        >>> d.matches.tolist(), d.summary()
+        ([1, 2, 0], {'rows': 3, 'unmatched': 1, 'ambiguous': 1, 'errors': 0, 'edge': 1})
+    """
+    matches: np.ndarray
+    errors: np.ndarray
+    edge: np.ndarray
+
+    @classmethod
+    def empty(cls, n: int, levels: int) -> "LevelDiagnostics":
+        count = np.uint8 if levels < 2 ** 8 else np.uint32
+        return cls(np.zeros(n, dtype=count), np.zeros(n, dtype=bool),
+                   np.zeros(n, dtype=bool))
+
+    def summary(self) -> Dict[str, int]:
+        """
+        Row counts: ``unmatched`` (no level, away from the edge),
+        ``ambiguous`` (more than one level), ``errors`` and ``edge``.
+        """
+        return {"rows": len(self.matches),
+                "unmatched": int(np.count_nonzero((self.matches == 0) & ~self.edge)),
+                "ambiguous": int(np.count_nonzero(self.matches > 1)),
+                "errors": int(np.count_nonzero(self.errors)),
+                "edge": int(np.count_nonzero(self.edge))}
+
+
+def level_mask(
+    expr: ExprIR,
+    columns: Mapping[str, np.ndarray],
+    n: int,
+    seg: np.ndarray | None = None,
+    diagnosis: LevelDiagnostics | None = None,
+) -> np.ndarray:
+    """
+    Boolean mask of the rows in which *expr* is True.
+
+    Rows for which any referenced offset falls outside ``[0, n)`` – or
+    into another segment of *seg* – are False; *diagnosis* gets them as
+    ``edge`` rows and the rows where *expr* raised as ``errors``.
+    """
+    offsets = [k for _, k in expr.refs] or [0]
+    lo, hi = max(0, -min(offsets)), n - max(0, max(offsets))
+    mask = np.zeros(n, dtype=bool)
+    if hi <= lo:
+        if diagnosis is not None:
+            diagnosis.edge[:] = True
+        return mask
+
+    args = [columns[name][lo + k:hi + k] for name, k in expr.refs]
+    inside = same_segment(seg, lo, hi, offsets)
+    errors = None if diagnosis is None else np.zeros(hi - lo, dtype=bool)
+    mask[lo:hi] = evaluate(expr, args, hi - lo, errors) & inside
+    if diagnosis is not None:
+        diagnosis.errors[lo:hi] |= errors & inside
+        diagnosis.edge[:lo] = diagnosis.edge[hi:] = True
+        diagnosis.edge[lo:hi] |= np.logical_not(inside)
+    return mask
+
+
+def derive_codes(
+    levels: List[dict],
+    columns: Mapping[str, np.ndarray],
+    n: int,
+    seg: np.ndarray | None = None,
+    diagnosis: LevelDiagnostics | None = None,
+) -> np.ndarray:
+    """
+    Index of the first level whose ``expr`` holds, ``len(levels)`` where
+    no level matches; *diagnosis* is filled on the way.
+
+    >>> derive_codes([{"name": "big", "expr": "rt > 500"}], {"rt": np.array([600, 400])}, 2)
+    array([0, 1], dtype=int32)
+    """
+    out = np.full(n, len(levels), dtype=np.int32)
+    free = np.ones(n, dtype=bool)
+    for j, lv in enumerate(levels):
+        holds = level_mask(parse_expr(lv["expr"]), columns, n, seg, diagnosis)
+        if diagnosis is not None:
+            diagnosis.matches += holds
+        hit = holds & free
+        out[hit] = j
+        free &= ~hit
+    return out
+
+
+def derive_column(
+    levels: List[dict],
+    columns: Mapping[str, np.ndarray],
+    n: int,
+    seg: np.ndarray | None = None,
+) -> np.ndarray:
+    """
+    Object array with the name of the first level whose ``expr`` holds,
+    ``None`` where no level matches.
+
+    Examples:
+        >>> cols = {"color": np.array(["red", "red", "blue", "blue"], dtype=object)}
+        >>> levels = [{"name": "repeat", "expr": "color[-1]==color[0]"},
+        ...           {"name": "switch", "expr": "color[-1]!=color[0]"}]
+        >>> derive_column(levels, cols, 4).tolist()
+        [None, 'repeat', 'switch', 'repeat']
+        >>> derive_column(levels, cols, 4, seg=np.array([0, 0, 1, 1])).tolist()
+        [None, 'repeat', None, 'repeat']
+    """
+    names = np.asarray([lv["name"] for lv in levels] + [None], dtype=object)
+    return names[derive_codes(levels, columns, n, seg)]
+
+
+class Columns(Dict[str, np.ndarray]):
+    """
+    Lazily materialised column arrays of *df* – a DataFrame or a mapping
+    of columns – and of derived factors, added as level codes and only
+    turned into level names when an expr reads them column-wise.
+    """
+
+    def __init__(self, df: pd.DataFrame | Mapping[str, np.ndarray]):
+        super().__init__()
+        self.df = df
+        self.coded: Dict[str, tuple] = {}
+
+    def add_codes(self, name: str, codes: np.ndarray, domain: List) -> None:
+        """Column *name*: positions *codes* in *domain*."""
+        self.pop(name, None)
+        self.coded[name] = (codes, domain)
+
+    def __missing__(self, name: str) -> np.ndarray:
+        if name in self.coded:
+            codes, domain = self.coded[name]
+            values = np.asarray(domain, dtype=object)[codes]
+        else:
+            values = column_values(self.df[name])
+        self[name] = values
+        return values
@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import Any, Iterable, List, Union
+
+import pandas as pd
+
+from mate_structure.sweetpea.builder.expr import parse_expr
+from mate_structure.sweetpea.utils.convert import is_regular, to_canonical
+
+# ════════════════════════════════════════════════════════════════════
+# Parquet / Arrow files and datasets, reading only what the design reads
+#
+# A source is a Parquet or Arrow IPC file, a directory of them (hive
+# partitioned or not) or a ``pyarrow.dataset.Dataset``.  Only the factor
+# columns, the plain columns their exprs read and the group columns
+# are read; *filters* (``[("subject", "in", [3, 7])]`` or a
+# ``pyarrow.dataset`` expression) go to the scanner, so skipped row
+# groups and partitions are never read.  IPC files are memory-mapped.
+# ════════════════════════════════════════════════════════════════════
+Source = Union[str, os.PathLike, Any]
+Filters = Union[List[tuple], List[List[tuple]], Any, None]
+
+PARQUET = (".parquet", ".pq")
+IPC = (".arrow", ".feather", ".ipc")
+
+
+def _format(path: Path) -> str:
+    if path.is_dir():
+        path = next((p for p in sorted(path.rglob("*"))
+                     if p.suffix.lower() in PARQUET + IPC), path)
+    return "ipc" if path.suffix.lower() in IPC else "parquet"
+
+
+def open_dataset(source: Source, *, format: str | None = None, partitioning: str | None = "hive"):
+    """A ``pyarrow.dataset.Dataset`` over *source* (format from the suffix)."""
+    import pyarrow.dataset as ds
+    from pyarrow import fs
+
+    if isinstance(source, ds.Dataset):
+        return source
+    path = Path(source).absolute()
+    format = format or _format(path)
+    filesystem = fs.LocalFileSystem(use_mmap=True) if format == "ipc" else None
+    return ds.dataset(str(path), format=format, partitioning=partitioning,
+                      filesystem=filesystem)
+
+
+def scan_filter(filters: Filters):
+    """*filters* as a dataset expression (DNF lists as in ``pq.read_table``)."""
+    import pyarrow.parquet as pq
+
+    if filters is None or not isinstance(filters, list):
+        return filters
+    return pq.filters_to_expression(filters)
+
+
+def factor_columns(factors: List[dict], group_by: str | List[str] | None = None) -> List[str]:
+    """
+    Columns :func:`to_canonical` reads: the factors, the plain columns
+    their exprs name and the *group_by* columns.
+
+    >>> factor_columns([{"name": "color", "levels": [{"name": "red"}]},
+    ...                 {"name": "fast", "levels": [{"name": "y", "expr": "rt < 500"}]}], "subject")
+    ['color', 'fast', 'rt', 'subject']
+    """
+    names = [f["name"] for f in factors]
+    reads = [v for f in factors for lv in f["levels"] if "expr" in lv
+             for v in parse_expr(lv["expr"]).variables]
+    groups = [group_by] if isinstance(group_by, str) else list(group_by or [])
+    return list(dict.fromkeys(names + reads + groups))
+
+
+def read_factors(
+    source: Source,
+    factors: List[dict],
+    *,
+    group_by: str | List[str] | None = None,
+    columns: Iterable[str] = (),
+    filters: Filters = None,
+    format: str | None = None,
+) -> pd.DataFrame:
+    """
+    The columns of *source* that :func:`to_canonical` needs (see
+    :func:`factor_columns`), plus *columns*, for the rows *filters*
+    keeps.  Derived factors missing from the source are left out.
+    """
+    dataset = open_dataset(source, format=format)
+    present = set(dataset.schema.names)
+    wanted = [c for c in factor_columns(factors, group_by) + list(columns) if c in present]
+    return dataset.to_table(columns=wanted, filter=scan_filter(filters)).to_pandas()
+
+
+def canonical_dataset(
+    source: Source,
+    factors: List[dict],
+    *,
+    dst: str | os.PathLike | None = None,
+    group_by: str | List[str] | None = None,
+    filters: Filters = None,
+    format: str | None = None,
+    batch_size: int = 1 << 17,
+    **canonical_kw,
+) -> pd.DataFrame:
+    """
+    :func:`to_canonical` on the factor columns of *source*.
+
+    Returns the canonical factor frame.  With *dst* (``.parquet`` or
+    ``.arrow``) the filtered source is also written there with the
+    derived columns added (or replaced): the source is streamed through
+    in batches of *batch_size* rows as Arrow data, so columns the design
+    does not read are never turned into pandas nor held in full.
+
+    Examples:
+        >>> import tempfile
+        >>> fs = [{"name": "color", "levels": [{"name": "red"}, {"name": "blue"}]},
+        ...       {"name": "rep", "levels": [{"name": "y", "expr": "color[-1]==color[0]"},
+        ...                                  {"name": "n", "expr": "color[-1]!=color[0]"}]}]
+        >>> log = pd.DataFrame({"subject": [1, 1, 1, 2, 2], "rt": [410, 380, 520, 600, 455],
+        ...                     "color": ["red", "red", "blue", "blue", "blue"]})
+        >>> tmp = tempfile.mkdtemp()
+        >>> log.to_parquet(f"{tmp}/log.parquet")
+        >>> canonical_dataset(f"{tmp}/log.parquet", fs, group_by="subject",
+        ...                   dst=f"{tmp}/out.parquet")["rep"].tolist()
+        [None, 'y', 'n', None, 'y']
+        >>> pd.read_parquet(f"{tmp}/out.parquet").columns.tolist()
+        ['subject', 'rt', 'color', 'rep']
+    """
+    dataset = open_dataset(source, format=format)
+    df = read_factors(dataset, factors, group_by=group_by, filters=filters)
+    canonical_kw.setdefault("copy", False)          # *df* is ours alone
+    out = to_canonical(df, factors, group_by=group_by, **canonical_kw)
+    if dst is not None:
+        write_derived(dataset, out, factors, dst, filters=filters, batch_size=batch_size)
+    return out
+
+
+def write_derived(
+    source: Source,
+    canonical: pd.DataFrame,
+    factors: List[dict],
+    dst: str | os.PathLike,
+    *,
+    filters: Filters = None,
+    batch_size: int = 1 << 17,
+) -> int:
+    """
+    Stream the rows of *source* that *filters* keeps into *dst*, with the
+    derived columns of *canonical* (one row per kept row, same order)
+    added or replaced.  Returns the rows written; *dst* is left alone if
+    the row counts differ.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    derived = [f["name"] for f in factors if not is_regular(f)]
+    columns = {n: pa.Array.from_pandas(canonical[n].reset_index(drop=True)) for n in derived}
+    dataset = open_dataset(source)
+    kept = [n for n in dataset.schema.names if n not in columns]
+    suffix = Path(dst).suffix.lower()
+    if suffix not in PARQUET + IPC:
+        raise ValueError(f"Unknown file type {suffix!r}: use .parquet or .arrow")
+    rows = dataset.count_rows(filter=scan_filter(filters))
+    if rows != len(canonical):
+        raise ValueError(f"Source has {rows} rows, the canonical frame {len(canonical)}")
+
+    schema = pa.schema([dataset.schema.field(n) for n in kept]
+                       + [pa.field(n, a.type) for n, a in columns.items()])
+    if suffix in PARQUET:
+        # dictionary pages for floats are tried and dropped per row group: slow
+        coded = [f.name for f in schema if not pa.types.is_floating(f.type)]
+        writer = pq.ParquetWriter(dst, schema, use_dictionary=coded)
+    else:
+        writer = pa.ipc.new_file(dst, schema)
+    done = 0
+    try:
+        scanner = dataset.scanner(columns=kept, filter=scan_filter(filters),
+                                  batch_size=batch_size)
+        for batch in scanner.to_batches():
+            arrays = batch.columns + [a.slice(done, len(batch)) for a in columns.values()]
+            writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+            done += len(batch)
+    finally:
+        writer.close()
+    return done
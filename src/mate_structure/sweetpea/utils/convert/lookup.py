@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Dict, List, Mapping, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from mate_structure.sweetpea.builder.expr import ExprIR, Ref, parse_expr
+from mate_structure.sweetpea.utils.convert.columnar import (
+    LevelDiagnostics, evaluate, same_segment,
+)
+
+# ════════════════════════════════════════════════════════════════════
+# truth-table evaluation of derived factors
+#
+# Regular factors take a finite set of levels (checked against the
+# design), derived factors one of their levels or ``None``.  A derived
+# factor is therefore a function of the levels of its parent refs:
+# evaluate it once per combination, then fill the column by gathering
+# from that table with mixed-radix integer keys built from level codes.
+# ════════════════════════════════════════════════════════════════════
+MAX_CELLS = 1 << 16             # larger tables fall back to columnar eval
+
+
+def factor_domain(factor: dict, regular: bool) -> List:
+    """
+    Values a factor column can hold, in design order.
+
+    Derived factors get a trailing ``None`` (no level matched).
+
+    >>> factor_domain({"name": "c", "levels": [{"name": "a"}, {"name": "b"}]}, True)
+    ['a', 'b']
+    >>> factor_domain({"name": "r", "levels": [{"name": "rep", "expr": "c[-1]==c[0]"}]}, False)
+    ['rep', None]
+    """
+    names = [lv["name"] for lv in factor["levels"]]
+    return names if regular else names + [None]
+
+
+def code_dtype(size: int) -> np.dtype:
+    """Smallest signed integer type able to hold codes ``-1 … size-1``."""
+    return np.dtype(np.int8 if size < 2 ** 7 else
+                    np.int16 if size < 2 ** 15 else np.int32)
+
+
+def encode(values: np.ndarray, domain: Sequence) -> np.ndarray:
+    """
+    Position of every value in *domain* (``-1`` if absent).
+
+    Missing values (``None`` / NaN) map to ``None``'s slot when the
+    domain has one.
+
+    >>> encode(np.array(["b", None, "a", "zz"], dtype=object), ["a", "b", None]).tolist()
+    [1, 2, 0, -1]
+    """
+    known = [v for v in domain if v is not None]
+    codes = pd.Index(known, dtype=object).get_indexer(values)
+    if None in domain:
+        codes[(codes < 0) & pd.isna(values)] = domain.index(None)
+    return codes.astype(code_dtype(len(domain)))
+
+
+@dataclass(frozen=True)
+class LevelTable:
+    """
+    Level code of a derived factor for every combination of its refs.
+
+    refs:    ``(factor, offset)`` pairs the levels read, table axes in order
+    sizes:   domain size of each ref
+    table:   flat code table (index of the matching level, ``len(levels)``
+             for no match) addressed by the mixed-radix key of the refs
+    matches: number of levels holding, per cell
+    errors:  per cell, whether evaluating some level raised
+    """
+    levels: Tuple[ExprIR, ...]
+    refs: Tuple[Ref, ...]
+    sizes: Tuple[int, ...]
+    table: np.ndarray
+    matches: np.ndarray
+    errors: np.ndarray
+
+    def gather(
+        self,
+        codes: Mapping[str, np.ndarray],
+        domains: Mapping[str, Sequence],
+        n: int,
+        seg: np.ndarray | None = None,
+        diagnosis: LevelDiagnostics | None = None,
+    ) -> np.ndarray:
+        """
+        Level codes for all *n* rows, from the parents' *codes*, with
+        *diagnosis* filled from the same keys.
+
+        Windows never reach into another segment of *seg*.
+        """
+        out = np.full(n, len(self.levels), dtype=self.table.dtype)
+        offsets = [k for _, k in self.refs] or [0]
+        lo, hi = max(0, -min(offsets)), n - max(0, max(offsets))
+        edge = [*range(min(lo, n)), *range(max(hi, lo), n)]
+
+        if hi > lo:
+            key = np.zeros(hi - lo, dtype=np.int64)
+            for (name, k), size in zip(self.refs, self.sizes):
+                key *= size
+                key += codes[name][lo + k:hi + k]
+            out[lo:hi] = self.table[key]
+            if diagnosis is not None:
+                diagnosis.matches[lo:hi] = self.matches[key]
+                diagnosis.errors[lo:hi] = self.errors[key]
+            inside = same_segment(seg, lo, hi, offsets)
+            if inside is not True:
+                edge += (lo + np.flatnonzero(~inside)).tolist()
+
+        # rows near an edge: some levels may still see their whole window
+        for i in edge:
+            out[i], *row = self._edge_row(i, codes, domains, n, seg)
+            if diagnosis is not None:
+                diagnosis.matches[i], diagnosis.errors[i], diagnosis.edge[i] = row
+        return out
+
+    def _edge_row(self, i, codes, domains, n, seg) -> Tuple[int, int, bool, bool]:
+        """Level code of row *i*, levels holding, raised, window cut off."""
+        def inside(k):
+            return 0 <= i + k < n and (seg is None or seg[i + k] == seg[i])
+
+        first, matches, raised, cut = len(self.levels), 0, False, False
+        for j, ir in enumerate(self.levels):
+            if not all(inside(k) for _, k in ir.refs):
+                cut = True
+                continue
+            vals = [domains[name][codes[name][i + k]] for name, k in ir.refs]
+            try:
+                holds = bool(ir.fn(*vals))
+            except Exception:
+                holds, raised = False, True
+            if holds:
+                first, matches = min(first, j), matches + 1
+        return first, matches, raised, cut
+
+
+def build_table(
+    levels: List[dict],
+    domains: Mapping[str, Sequence],
+    max_cells: int = MAX_CELLS,
+) -> LevelTable | None:
+    """
+    Tabulate *levels* over the domains of everything they reference.
+
+    Returns ``None`` if a ref has no known domain (a plain data column,
+    or the factor itself) or the table would exceed *max_cells*.
+
+    Examples:
+        >>> t = build_table(
+        ...     [{"name": "repeat", "expr": "color[-1]==color[0]"},
+        ...      {"name": "switch", "expr": "color[-1]!=color[0]"}],
+        ...     {"color": ["red", "blue"]})
+        >>> t.refs, t.table.tolist()
+        ((('color', -1), ('color', 0)), [0, 1, 1, 0])
+    """
+    irs = tuple(parse_expr(lv["expr"]) for lv in levels)
+    refs = tuple(dict.fromkeys(r for ir in irs for r in ir.refs))
+    if any(name not in domains for name, _ in refs):
+        return None
+    sizes = tuple(len(domains[name]) for name, _ in refs)
+    cells = int(np.prod(sizes, dtype=np.int64))
+    if cells > max_cells:
+        return None
+
+    # one column per ref holding its value in every combination
+    grid = np.indices(sizes).reshape(len(sizes), cells)
+    values = {
+        ref: np.asarray(domains[ref[0]], dtype=object)[grid[a]]
+        for a, ref in enumerate(refs)
+    }
+
+    table = np.full(cells, len(irs), dtype=code_dtype(len(irs) + 1))
+    matches = np.zeros(cells, dtype=np.uint8 if len(irs) < 2 ** 8 else np.uint32)
+    errors = np.zeros(cells, dtype=bool)
+    free = np.ones(cells, dtype=bool)
+    for j, ir in enumerate(irs):
+        holds = evaluate(ir, [values[r] for r in ir.refs], cells, errors)
+        matches += holds
+        hit = holds & free
+        table[hit] = j
+        free &= ~hit
+    return LevelTable(irs, refs, sizes, table, matches, errors)
+
+
+class Codes(Dict[str, np.ndarray]):
+    """Lazily computed level codes of factor columns (``-1`` = unknown)."""
+
+    def __init__(self, columns: Mapping[str, np.ndarray],
+                 domains: Mapping[str, Sequence]):
+        super().__init__()
+        self.columns = columns
+        self.domains = domains
+
+    def __missing__(self, name: str) -> np.ndarray:
+        codes = self[name] = encode(self.columns[name], self.domains[name])
+        return codes
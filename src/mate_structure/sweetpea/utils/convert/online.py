@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+from collections import deque
+from typing import Any, Dict, List, Mapping, Tuple
+
+from mate_structure.sweetpea.builder.expr import ExprIR, parse_expr
+from mate_structure.sweetpea.utils.convert import is_regular, topo_sort_factors
+
+# ════════════════════════════════════════════════════════════════════
+# trial-by-trial classification for live experiments
+# ════════════════════════════════════════════════════════════════════
+class OnlineCanonicalizer:
+    """
+    Label the derived levels of each new trial as it happens.
+
+    Built from the same factor dicts as :func:`to_canonical`; keeps a
+    ring buffer of the last trials, as deep as the design's largest
+    look-back, so every :meth:`push` costs the same however long the
+    session runs.  Levels come out exactly as ``to_canonical`` would
+    give them for the trials pushed so far.
+
+    Examples:
+        >>> oc = OnlineCanonicalizer([
+        ...     {"name": "color", "levels": [{"name": "red"}, {"name": "blue"}]},
+        ...     {"name": "rep", "levels": [{"name": "repeat", "expr": "color[-1]==color[0]"},
+        ...                                {"name": "switch", "expr": "color[-1]!=color[0]"}]},
+        ... ])
+        >>> oc.depth
+        1
+        >>> [oc.push({"color": c}) for c in ("red", "red", "blue")]
+        [{'rep': None}, {'rep': 'repeat'}, {'rep': 'switch'}]
+        >>> oc.push({"color": "green"})
+        Traceback (most recent call last):
+        ...
+        ValueError: Level 'green' of 'color' is not in design ['red', 'blue']
+    """
+
+    def __init__(
+        self,
+        factors: List[dict],
+        *,
+        map_regular: Dict[str, Dict[str, str]] | None = None,
+    ):
+        ordered = topo_sort_factors(factors)
+        self.map_regular = map_regular or {}
+        self.regular: Dict[str, List[str]] = {
+            f["name"]: [lv["name"] for lv in f["levels"]]
+            for f in ordered if is_regular(f)
+        }
+        self.derived: List[Tuple[str, List[Tuple[str, ExprIR]]]] = [
+            (f["name"], [(lv["name"], parse_expr(lv["expr"])) for lv in f["levels"]])
+            for f in ordered if not is_regular(f)
+        ]
+
+        refs = [r for _, levels in self.derived for _, ir in levels for r in ir.refs]
+        if any(k > 0 for _, k in refs):
+            raise ValueError("Online classification cannot look at future trials")
+        self.depth = max([0] + [-k for _, k in refs])
+        self._kept = {name for name, k in refs if k < 0}
+        self._history: deque = deque(maxlen=self.depth)
+
+    def reset(self) -> None:
+        """Forget earlier trials (e.g. at a new block or participant)."""
+        self._history.clear()
+
+    def _value(self, trial: Mapping[str, Any], name: str, k: int):
+        return trial[name] if k == 0 else self._history[-k - 1][name]
+
+    def push(self, trial: Mapping[str, Any]) -> Dict[str, Any]:
+        """
+        Add the next trial (factor name → value) and return its derived
+        levels (``None`` where no level applies yet).
+        """
+        current = dict(trial)
+        for name, levels in self.regular.items():
+            value = current[name]
+            if name in self.map_regular:
+                value = current[name] = self.map_regular[name].get(value)
+            if value not in levels:
+                raise ValueError(f"Level {value!r} of '{name}' is not in design {levels}")
+
+        seen = len(self._history)
+        derived: Dict[str, Any] = {}
+        for name, levels in self.derived:
+            current[name] = derived[name] = None
+            for level, ir in levels:
+                if any(-k > seen for _, k in ir.refs):
+                    continue
+                try:
+                    hit = ir.fn(*(self._value(current, n, k) for n, k in ir.refs))
+                except Exception:
+                    continue
+                if hit:
+                    current[name] = derived[name] = level
+                    break
+
+        if self.depth:
+            self._history.appendleft({n: current[n] for n in self._kept})
+        return derived
@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+
+import pandas as pd
+
+from mate_structure.sweetpea.builder.expr import parse_expr
+from mate_structure.sweetpea.utils.convert import to_canonical, topo_sort_factors
+
+# ════════════════════════════════════════════════════════════════════
+# chunked to_canonical for logs larger than memory
+# ════════════════════════════════════════════════════════════════════
+Source = Union[str, os.PathLike, Iterable[pd.DataFrame]]
+
+
+def window_context(factors: List[dict]) -> Tuple[int, int]:
+    """
+    Rows of context a trial needs *before* and *after* itself so that
+    every derived level comes out as on the full log.
+
+    Derived factors built on other window factors add up:
+
+    >>> window_context([
+    ...     {"name": "color", "levels": [{"name": "red"}, {"name": "blue"}]},
+    ...     {"name": "rep", "levels": [{"name": "y", "expr": "color[-1]==color[0]"}]},
+    ...     {"name": "rep2", "levels": [{"name": "y", "expr": "rep[-2]==rep[0]"}]},
+    ... ])
+    (3, 0)
+    """
+    back: Dict[str, int] = {}
+    ahead: Dict[str, int] = {}
+    for f in topo_sort_factors(factors):
+        b = a = 0
+        for lv in f["levels"]:
+            if "expr" not in lv:
+                continue
+            for name, k in parse_expr(lv["expr"]).refs:
+                own = name == f["name"]         # reads the raw column
+                b = max(b, (0 if own else back.get(name, 0)) - k)
+                a = max(a, (0 if own else ahead.get(name, 0)) + k)
+        back[f["name"]], ahead[f["name"]] = b, a
+    return max(back.values(), default=0), max(ahead.values(), default=0)
+
+
+def read_chunks(path: str | os.PathLike, chunksize: int, **read_kw) -> Iterator[pd.DataFrame]:
+    """
+    Read a CSV or Parquet file in chunks of *chunksize* rows, numbering
+    rows continuously across chunks.
+    """
+    if Path(path).suffix.lower() in (".parquet", ".pq"):
+        import pyarrow.parquet as pq
+
+        start = 0
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize,
+                                                       **read_kw):
+            chunk = batch.to_pandas()
+            chunk.index = pd.RangeIndex(start, start + len(chunk))
+            start += len(chunk)
+            yield chunk
+    else:
+        yield from pd.read_csv(path, chunksize=chunksize, **read_kw)
+
+
+def canonical_chunks(
+    source: Source,
+    factors: List[dict],
+    *,
+    chunksize: int = 100_000,
+    read_kw: dict | None = None,
+    **canonical_kw,
+) -> Iterator[pd.DataFrame]:
+    """
+    Streaming :func:`to_canonical`: yield the canonicalized log chunk by
+    chunk.
+
+    The raw rows a window needs (see :func:`window_context`) are carried
+    across chunk boundaries, so derived levels such as
+    ``congruency[-1]`` are the same as on the full log; peak memory is
+    one chunk plus that context.  Each chunk only has to show a subset
+    of every regular factor's levels, so the automatic 1-to-1 remap is
+    not applied – pass ``map_regular`` if the log uses other names.
+
+    Parameters
+    ----------
+    source : path or iterable of DataFrame
+        A CSV / Parquet file (read in *chunksize* rows) or ready chunks.
+    factors : list of dict
+        Factor dicts as for :func:`to_canonical`.
+    read_kw : dict, optional
+        Passed on to ``pd.read_csv`` / ``ParquetFile.iter_batches``.
+    **canonical_kw
+        ``only_factors``, ``map_regular``, ``categorical``.
+
+    Examples:
+        >>> fs = [{"name": "color", "levels": [{"name": "red"}, {"name": "blue"}]},
+        ...       {"name": "rep", "levels": [{"name": "y", "expr": "color[-1]==color[0]"},
+        ...                                  {"name": "n", "expr": "color[-1]!=color[0]"}]}]
+        >>> log = pd.DataFrame({"color": ["red", "red", "blue", "blue", "red"]})
+        >>> chunks = (log.iloc[i:i + 2] for i in range(0, 5, 2))
+        >>> pd.concat(canonical_chunks(chunks, fs))["rep"].tolist()
+        [None, 'y', 'n', 'y', 'n']
+    """
+    if isinstance(source, (str, os.PathLike)):
+        source = read_chunks(source, chunksize, **(read_kw or {}))
+    back, ahead = window_context(factors)
+
+    carry: pd.DataFrame | None = None       # raw rows kept for context
+    done = 0                                # leading rows of carry already out
+    for chunk in source:
+        frame = chunk if carry is None else pd.concat([carry, chunk])
+        end = max(len(frame) - ahead, done)
+        if end > done:
+            out = to_canonical(frame, factors, partial=True, **canonical_kw)
+            yield out.iloc[done:end]
+        start = max(0, end - back)
+        carry, done = frame.iloc[start:], end - start
+
+    if carry is not None and len(carry) > done:
+        out = to_canonical(carry, factors, partial=True, **canonical_kw)
+        yield out.iloc[done:]
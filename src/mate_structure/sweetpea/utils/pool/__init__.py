@@ -0,0 +1,439 @@
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from itertools import chain, islice
+from typing import Any, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from mate_structure.sweetpea.builder.cache import design_hash
+
+# ════════════════════════════════════════════════════════════════════
+# integer-coded pools of synthesized sequences
+#
+# One file:  MAGIC · u32 format · u32 header length · JSON header,
+# zero-padded to ALIGN bytes, then
+#   offsets  int64[n + 1]               first row of each sequence
+#   codes    int8/16/32[rows, factors]  level index, -1 = no level
+# so sequence i is ``codes[offsets[i]:offsets[i + 1]]`` – a slice of
+# the memory map, nothing is read until it is touched.
+# ════════════════════════════════════════════════════════════════════
+MAGIC = b"SPPOOL\x00\x00"
+FORMAT = 1
+ALIGN = 64
+MISSING = -1
+
+
+def _code_dtype(factors: List[dict]) -> np.dtype:
+    """Smallest signed integer holding every level index (and -1)."""
+    most = max((len(f["levels"]) for f in factors), default=0)
+    for dtype in (np.int8, np.int16, np.int32):
+        if most <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    raise ValueError(f"Factor with {most} levels")
+
+
+def _encode(values: Sequence, levels: List[str], factor: str, dtype: np.dtype) -> np.ndarray:
+    """Level index of every value; missing (``None``, NaN, ``""``) → -1."""
+    if isinstance(getattr(values, "dtype", None), pd.CategoricalDtype) \
+            and list(values.cat.categories) == levels:
+        return values.cat.codes.to_numpy().astype(dtype, copy=False)
+    # factorize once, then look up only the distinct values
+    seen, distinct = pd.factorize(np.asarray(values, dtype=object))
+    lookup = pd.Index(levels).get_indexer(distinct)
+    unknown = [v for v, code in zip(distinct, lookup) if code == MISSING and v != ""]
+    if unknown:
+        raise ValueError(f"{unknown[0]!r} is not a level of factor {factor!r}")
+    return np.append(lookup, MISSING).astype(dtype)[seen]
+
+
+def _level_names(design: dict) -> List[dict]:
+    return [{"name": f["name"], "levels": [lv["name"] for lv in f["levels"]]}
+            for f in design["factors"]]
+
+
+def _chunks(sequences: Iterable[dict], chunk: int) -> Iterator[List[dict]]:
+    sequences = iter(sequences)
+    return iter(lambda: list(islice(sequences, chunk)), [])
+
+
+def _encode_chunk(part: List[dict], factors: List[dict],
+                  dtype: np.dtype) -> Tuple[np.ndarray, np.ndarray]:
+    """Trials per sequence and ``(rows, factors)`` codes of SweetPea sequences."""
+    n = np.array([len(seq[factors[0]["name"]]) for seq in part], dtype=np.int64)
+    block = np.empty((int(n.sum()), len(factors)), dtype=dtype)
+    for j, f in enumerate(factors):
+        values = list(chain.from_iterable(seq[f["name"]] for seq in part))
+        if len(values) != len(block):
+            raise ValueError(f"Factor {f['name']!r} has a different length "
+                             "than the sequence")
+        block[:, j] = _encode(values, f["levels"], f["name"], dtype)
+    return n, block
+
+
+class SequencePool:
+    """
+    Sequences of one design, each factor stored as level indices.
+
+    factors:  ``[{"name", "levels"}]`` of the design, in design order
+    key:      :func:`design_hash` of the design
+    offsets:  ``int64[n + 1]``, rows of sequence *i* are
+              ``offsets[i]:offsets[i + 1]``
+    codes:    ``(rows, factors)`` level indices, -1 where a factor has
+              no level (the first trials of a window)
+
+    Build one with :meth:`from_sequences` (SweetPea's output) or
+    :meth:`from_frame` (the long format of :meth:`to_frame`), store it
+    with :meth:`write` and map it back with :meth:`open`.
+
+    Examples:
+        >>> design = {"factors": [
+        ...     {"name": "color", "levels": [{"name": "red"}, {"name": "blue"}]},
+        ...     {"name": "rep", "levels": [{"name": "y", "expr": "color[-1]==color[0]"},
+        ...                                {"name": "n", "expr": "color[-1]!=color[0]"}]}],
+        ...     "crossing": ["color"]}
+        >>> pool = SequencePool.from_sequences(design, [
+        ...     {"color": ["red", "blue", "blue"], "rep": ["", "n", "y"]},
+        ...     {"color": ["blue", "red"], "rep": ["", "n"]}])
+        >>> len(pool), pool.codes.dtype, pool[1].tolist()
+        (2, dtype('int8'), [[1, -1], [0, 1]])
+        >>> pool.sequence(0)
+        {'color': ['red', 'blue', 'blue'], 'rep': ['', 'n', 'y']}
+        >>> pool.to_frame()
+           sequence  trial color  rep
+        0         0      0   red  NaN
+        1         0      1  blue    n
+        2         0      2  blue    y
+        3         1      0  blue  NaN
+        4         1      1   red    n
+    """
+
+    def __init__(self, factors: List[dict], key: str, offsets: np.ndarray, codes: np.ndarray):
+        self.factors = factors
+        self.key = key
+        self.offsets = offsets
+        self.codes = codes
+
+    @property
+    def names(self) -> List[str]:
+        return [f["name"] for f in self.factors]
+
+    @property
+    def lengths(self) -> np.ndarray:
+        """Trials of each sequence."""
+        return np.diff(self.offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        """Level indices of sequence *i*, ``(trials, factors)`` – a view."""
+        if not -len(self) <= i < len(self):
+            raise IndexError(f"Sequence {i} out of range for a pool of {len(self)}")
+        i %= len(self)
+        return self.codes[self.offsets[i]:self.offsets[i + 1]]
+
+    def sequence(self, i: int) -> Dict[str, List[str]]:
+        """Sequence *i* as SweetPea gives it (``""`` where there is no level)."""
+        rows = self[i]
+        return {f["name"]: np.asarray(f["levels"] + [""], dtype=object)[rows[:, j]].tolist()
+                for j, f in enumerate(self.factors)}
+
+    def matches(self, design: dict) -> bool:
+        """True if the pool was drawn from *design*."""
+        return self.key == design_hash(design)
+
+    # ---------- building -------------------------------------------
+    @classmethod
+    def from_sequences(
+        cls,
+        design: dict,
+        sequences: Iterable[Dict[str, List[str]]],
+        *,
+        chunk: int = 4096,
+    ) -> "SequencePool":
+        """
+        Pool of SweetPea *sequences* (``{factor: [level, …]}``) of
+        *design*, encoded *chunk* sequences at a time.  Raises
+        ``ValueError`` on a level the design does not have.
+        """
+        factors = _level_names(design)
+        dtype = _code_dtype(factors)
+        lengths: List[np.ndarray] = []
+        blocks: List[np.ndarray] = []
+        for part in _chunks(sequences, chunk):
+            n, block = _encode_chunk(part, factors, dtype)
+            lengths.append(n)
+            blocks.append(block)
+
+        offsets = np.zeros(1 + sum(len(n) for n in lengths), dtype=np.int64)
+        np.cumsum(np.concatenate(lengths) if lengths else [], out=offsets[1:])
+        codes = (np.concatenate(blocks) if blocks
+                 else np.empty((0, len(factors)), dtype=dtype))
+        return cls(factors, design_hash(design), offsets, codes)
+
+    @classmethod
+    def from_frame(
+        cls,
+        design: dict,
+        df: pd.DataFrame,
+        *,
+        sequence: str = "sequence",
+        trial: str | None = "trial",
+    ) -> "SequencePool":
+        """
+        Pool of a long-format frame, one row per trial with a column per
+        factor (strings or Categoricals, missing where there is no level).
+
+        Sequences are numbered in order of first appearance in the
+        *sequence* column; rows keep their order within a sequence, or
+        follow the *trial* column if the frame has one.
+        """
+        factors = _level_names(design)
+        for f in factors:
+            if f["name"] not in df.columns:
+                raise KeyError(f"Missing factor column '{f['name']}'")
+        dtype = _code_dtype(factors)
+
+        ids, _ = pd.factorize(df[sequence], sort=False)
+        if trial is not None and trial in df.columns:
+            order = np.lexsort((df[trial].to_numpy(), ids))
+        else:
+            order = np.argsort(ids, kind="stable")
+        codes = np.empty((len(df), len(factors)), dtype=dtype)
+        for j, f in enumerate(factors):
+            codes[:, j] = _encode(df[f["name"]], f["levels"], f["name"], dtype)[order]
+
+        offsets = np.zeros(ids.max(initial=-1) + 2, dtype=np.int64)
+        np.cumsum(np.bincount(ids, minlength=len(offsets) - 1), out=offsets[1:])
+        return cls(factors, design_hash(design), offsets, codes)
+
+    def to_frame(self, sequences: Sequence[int] | None = None, *,
+                 categorical: bool = True) -> pd.DataFrame:
+        """
+        Long format, one row per trial: ``sequence``, ``trial`` and a
+        column per factor, as :func:`to_canonical` and :func:`report`
+        take it.  Factor columns are Categoricals in design level order
+        (strings with *categorical* False); no level is NaN / ``None``.
+        """
+        if sequences is None:
+            ids = np.arange(len(self))
+            rows = slice(None)
+        else:
+            ids = np.asarray(sequences, dtype=np.int64) % max(len(self), 1)
+            starts, lengths = self.offsets[ids], self.lengths[ids]
+            rows = (np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+                    + np.repeat(starts, lengths))
+        lengths = self.lengths[ids]
+        codes = self.codes[rows]
+        first = np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+        columns: Dict[str, Any] = {
+            "sequence": np.repeat(ids, lengths),
+            "trial": np.arange(len(codes)) - first,
+        }
+        for j, f in enumerate(self.factors):
+            if categorical:
+                columns[f["name"]] = pd.Categorical.from_codes(codes[:, j], f["levels"])
+            else:
+                columns[f["name"]] = np.asarray(f["levels"] + [None], dtype=object)[codes[:, j]]
+        return pd.DataFrame(columns)
+
+    # ---------- file -----------------------------------------------
+    def _header(self) -> bytes:
+        header = json.dumps({
+            "design_hash": self.key,
+            "factors": self.factors,
+            "dtype": self.codes.dtype.name,
+            "sequences": len(self),
+            "rows": len(self.codes),
+        }, separators=(",", ":")).encode()
+        start = len(MAGIC) + 8 + len(header)
+        return header + b"\x00" * (-start % ALIGN)
+
+    def write(self, path: str | os.PathLike) -> None:
+        """Store the pool as one file; see :meth:`open`."""
+        header = self._header()
+        tmp = f"{os.fspath(path)}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as out:
+            out.write(MAGIC)
+            out.write(np.array([FORMAT, len(header)], dtype="<u4").tobytes())
+            out.write(header)
+            out.write(self.offsets.astype("<i8", copy=False).tobytes())
+            out.write(np.ascontiguousarray(self.codes).tobytes())
+        os.replace(tmp, path)
+
+    @classmethod
+    def open(cls, path: str | os.PathLike, *, design: dict | None = None,
+             mmap: bool = True) -> "SequencePool":
+        """
+        Pool stored with :meth:`write`, memory-mapped (read-only) unless
+        *mmap* is False.  With *design*, raises ``ValueError`` if the
+        pool was drawn from another design.
+        """
+        with open(path, "rb") as src:
+            start = src.read(len(MAGIC) + 8)
+            if start[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"{os.fspath(path)!r} is not a sequence pool")
+            fmt, size = np.frombuffer(start[len(MAGIC):], dtype="<u4")
+            if fmt != FORMAT:
+                raise ValueError(f"Unsupported pool format {int(fmt)}")
+            header = json.loads(src.read(int(size)).rstrip(b"\x00"))
+        if design is not None and header["design_hash"] != design_hash(design):
+            raise ValueError("Sequence pool was drawn from another design")
+
+        at = len(MAGIC) + 8 + int(size)
+        n, rows, width = header["sequences"], header["rows"], len(header["factors"])
+        dtype = np.dtype(header["dtype"]).newbyteorder("<")
+        if mmap:
+            offsets = np.memmap(path, dtype="<i8", mode="r", offset=at, shape=(n + 1,))
+            codes = np.memmap(path, dtype=dtype, mode="r", offset=at + 8 * (n + 1),
+                              shape=(rows, width))
+        else:
+            with open(path, "rb") as src:
+                src.seek(at)
+                offsets = np.frombuffer(src.read(8 * (n + 1)), dtype="<i8")
+                codes = np.frombuffer(src.read(rows * width * dtype.itemsize),
+                                      dtype=dtype).reshape(rows, width)
+        return cls(header["factors"], header["design_hash"], offsets, codes)
+
+
+# ════════════════════════════════════════════════════════════════════
+# SweetPea experiments → long-format frame / Parquet / Arrow
+# ════════════════════════════════════════════════════════════════════
+def _long_columns(lengths: np.ndarray, first: int, sequence: str, trial: str) -> Dict[str, np.ndarray]:
+    starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return {sequence: np.repeat(np.arange(first, first + len(lengths)), lengths),
+            trial: np.arange(int(lengths.sum())) - starts}
+
+
+def _inferred(experiments: List[dict]) -> Tuple[np.ndarray, List[dict], List[np.ndarray]]:
+    """Trials per sequence, factors with levels in order of appearance, codes."""
+    names = list(experiments[0]) if experiments else []
+    lengths = np.array([len(e[names[0]]) for e in experiments], dtype=np.int64)
+    factors, codes = [], []
+    for name in names:
+        seen, distinct = pd.factorize(np.asarray(
+            list(chain.from_iterable(e[name] for e in experiments)), dtype=object))
+        if len(seen) != lengths.sum():
+            raise ValueError(f"Factor {name!r} has a different length than the sequence")
+        keep = np.array([v != "" for v in distinct], dtype=bool)
+        lookup = np.append(np.where(keep, np.cumsum(keep) - 1, MISSING), MISSING)
+        factors.append({"name": name, "levels": list(distinct[keep])})
+        codes.append(lookup[seen])
+    dtype = _code_dtype(factors)
+    return lengths, factors, [c.astype(dtype) for c in codes]
+
+
+def experiments_frame(
+    experiments: Iterable[Dict[str, List[str]]],
+    design: dict | None = None,
+    *,
+    sequence: str = "sequence",
+    trial: str = "trial",
+    categorical: bool = True,
+    chunk: int = 4096,
+) -> pd.DataFrame:
+    """
+    SweetPea's synthesized *experiments* (``{factor: [level, …]}`` per
+    sequence) as one long-format frame: *sequence*, *trial* and a column
+    per factor, ready for :func:`to_canonical` / :func:`report`.
+
+    Factor columns are Categoricals whose categories are the *design*'s
+    levels in design order, or – without a design – the levels in order
+    of appearance; ``""`` (no level yet) becomes NaN.  Every factor is
+    encoded in one vectorized pass per *chunk* sequences.
+
+    Examples:
+        >>> experiments = [{"color": ["red", "blue"], "rep": ["", "n"]},
+        ...                {"color": ["blue", "blue"], "rep": ["", "y"]}]
+        >>> experiments_frame(experiments)
+           sequence  trial color  rep
+        0         0      0   red  NaN
+        1         0      1  blue    n
+        2         1      0  blue  NaN
+        3         1      1  blue    y
+        >>> experiments_frame(experiments)["rep"].cat.categories.tolist()
+        ['n', 'y']
+    """
+    if design is not None:
+        pool = SequencePool.from_sequences(design, experiments, chunk=chunk)
+        frame = pool.to_frame(categorical=categorical)
+        return frame.rename(columns={"sequence": sequence, "trial": trial})
+
+    lengths, factors, codes = _inferred(list(experiments))
+    columns: Dict[str, Any] = _long_columns(lengths, 0, sequence, trial)
+    for f, c in zip(factors, codes):
+        column = pd.Categorical.from_codes(c, f["levels"])
+        columns[f["name"]] = column if categorical else np.asarray(column, dtype=object)
+    return pd.DataFrame(columns)
+
+
+def _arrow_batch(lengths: np.ndarray, first: int, factors: List[dict],
+                 codes: List[np.ndarray], sequence: str, trial: str):
+    import pyarrow as pa
+
+    arrays = {k: pa.array(v) for k, v in _long_columns(lengths, first, sequence, trial).items()}
+    for f, c in zip(factors, codes):
+        indices = pa.array(c, mask=c == MISSING)
+        arrays[f["name"]] = pa.DictionaryArray.from_arrays(indices, pa.array(f["levels"], pa.string()))
+    return pa.RecordBatch.from_pydict(arrays)
+
+
+def write_experiments(
+    experiments: Iterable[Dict[str, List[str]]],
+    path: str | os.PathLike,
+    design: dict | None = None,
+    *,
+    sequence: str = "sequence",
+    trial: str = "trial",
+    chunk: int = 4096,
+) -> int:
+    """
+    Write :func:`experiments_frame` straight to a Parquet (``.parquet``,
+    ``.pq``) or Arrow IPC (``.arrow``, ``.feather``) file, with every
+    factor a dictionary-encoded column.  With a *design* the level
+    dictionaries are fixed, so *experiments* are streamed *chunk*
+    sequences at a time; without one they are gathered first.  Needs
+    ``pyarrow``.  Returns the number of sequences written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    suffix = Path(path).suffix.lower()
+    if suffix not in (".parquet", ".pq", ".arrow", ".feather"):
+        raise ValueError(f"Unknown file type {suffix!r}: use .parquet or .arrow")
+
+    if design is not None:
+        factors = _level_names(design)
+        dtype = _code_dtype(factors)
+        batches = ((n, [block[:, j] for j in range(len(factors))])
+                   for n, block in (_encode_chunk(part, factors, dtype)
+                                    for part in _chunks(experiments, chunk)))
+    else:
+        lengths, factors, codes = _inferred(list(experiments))
+        batches = iter([(lengths, codes)])
+
+    def open_writer(schema):
+        if suffix in (".parquet", ".pq"):
+            return pq.ParquetWriter(path, schema)
+        return pa.ipc.new_file(path, schema)
+
+    written, writer = 0, None
+    try:
+        for lengths, codes in batches:
+            batch = _arrow_batch(lengths, written, factors, codes, sequence, trial)
+            writer = writer or open_writer(batch.schema)
+            writer.write_batch(batch)
+            written += len(lengths)
+        if writer is None:                  # no experiments: only the schema
+            empty = _arrow_batch(np.zeros(0, np.int64), 0, factors,
+                                 [np.zeros(0, np.int8) for _ in factors], sequence, trial)
+            writer = open_writer(empty.schema)
+    finally:
+        if writer is not None:
+            writer.close()
+    return written
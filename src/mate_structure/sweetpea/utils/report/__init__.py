@@ -1,14 +1,228 @@
+import json
+import zlib
+
+import numpy as np
 import pandas as pd
+from dataclasses import dataclass
 from itertools import combinations
-from typing import Iterable, Mapping, Tuple, Dict, Any
+from typing import Iterable, List, Mapping, Tuple, Dict, Any
+
+from mate_structure.sweetpea.utils.convert.backend import Backend, factorize, resolve_backend
+from mate_structure.sweetpea.utils.convert.dataset import Filters, Source, open_dataset, scan_filter
+
+_MAX_DENSE = 1 << 22            # cells of the largest dense count table
+
+
+# ════════════════════════════════════════════════════════════════════
+# integer coding of columns
+# ════════════════════════════════════════════════════════════════════
+@dataclass
+class Coded:
+    """
+    A column factorized once.
+
+    slots:   per row, the index of its value in ``levels``; missing
+             values get the extra slot ``len(levels)``
+    levels:  distinct values, sorted (categories, for a Categorical)
+    tie:     slot order ``value_counts`` uses to break equal counts
+
+    Missing values – ``None``, NaN, a null – are all reported as NaN,
+    whatever the backend or dtype.
+    """
+    slots: np.ndarray
+    levels: np.ndarray
+    tie: np.ndarray
+    categorical: bool
+
+    @property
+    def size(self) -> int:
+        return len(self.levels) + 1
+
+
+def code_column(s: pd.Series) -> Coded:
+    """
+    >>> c = code_column(pd.Series(["b", None, "a", "b"]))
+    >>> c.slots.tolist(), c.levels.tolist(), c.tie.tolist()
+    ([1, 2, 0, 1], ['a', 'b'], [1, 2, 0])
+    """
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        return _categorical(s.cat.codes.to_numpy(), s.cat.categories.tolist())
+    return _factorized(*factorize(s))
+
+
+def code_values(backend: Backend, frame, name: str) -> Coded:
+    """:func:`code_column` of column *name* of a *backend* table."""
+    categories = backend.categories(frame, name)
+    if categories is not None:
+        return _categorical(*categories)
+    return _factorized(*backend.factorize(frame, name))
+
+
+def _categorical(codes: np.ndarray, categories: list) -> Coded:
+    k = len(categories)
+    slots = np.asarray(codes).astype(np.int64)
+    slots[slots < 0] = k
+    levels = np.empty(k, dtype=object)
+    levels[:] = categories
+    return Coded(slots, levels, np.arange(k + 1), True)
+
+
+def _factorized(codes: np.ndarray, uniques: np.ndarray) -> Coded:
+    # appearance order (value_counts ties) → sorted order (groupby keys)
+    missing = np.asarray(pd.isna(uniques))
+    present = np.flatnonzero(~missing)
+    try:
+        order = present[np.argsort(uniques[present], kind="stable")]
+    except TypeError:                           # unorderable mix of types
+        order = present
+    slot_of = np.full(len(uniques), len(order), dtype=np.int64)
+    slot_of[order] = np.arange(len(order))
+    levels = np.empty(len(order), dtype=object)
+    levels[:] = uniques[order].tolist()
+    return Coded(slot_of[codes], levels, slot_of, False)
+
+
+# ════════════════════════════════════════════════════════════════════
+# count tables
+# ════════════════════════════════════════════════════════════════════
+def _key(coded: List[Coded]) -> np.ndarray:
+    key = np.zeros(len(coded[0].slots), dtype=np.int64)
+    for c in coded:
+        key *= c.size
+        key += c.slots
+    return key
+
+
+def count_table(coded: List[Coded]) -> np.ndarray | Tuple[np.ndarray, np.ndarray]:
+    """
+    Joint counts of the columns *coded*: a dense array with one axis per
+    column when it has at most ``_MAX_DENSE`` cells, otherwise the
+    sorted observed slot combinations (one row each) and their counts.
+    """
+    shape = tuple(c.size for c in coded)
+    cells = int(np.prod(shape, dtype=np.float64))
+    if cells <= _MAX_DENSE:
+        return np.bincount(_key(coded), minlength=cells).reshape(shape)
+    if cells < 2 ** 62:
+        keys, counts = np.unique(_key(coded), return_counts=True)
+        return np.stack(np.unravel_index(keys, shape), axis=1), counts
+    return np.unique(np.stack([c.slots for c in coded], axis=1),
+                     axis=0, return_counts=True)
+
+
+def marginal(table: np.ndarray, axes: Tuple[int, ...], keep: Tuple[int, ...]) -> np.ndarray:
+    """Sum a dense *table* over *axes* down to the axes *keep*, in that order."""
+    summed = table.sum(axis=tuple(i for i, a in enumerate(axes) if a not in keep))
+    rest = [a for a in axes if a in keep]
+    return summed.transpose([rest.index(a) for a in keep])
+
+
+def _scale(counts: np.ndarray, n: int, normalize: bool) -> list:
+    if not normalize:
+        return counts.tolist()
+    with np.errstate(invalid="ignore"):         # empty frame → NaN, as pandas
+        return (counts / n).tolist()
+
+
+def one_way(c: Coded, counts: np.ndarray, n: int, normalize: bool) -> Dict[Any, int | float]:
+    """``value_counts(dropna=False)`` as a dict, from per-slot *counts*."""
+    shown = [s for s in c.tie.tolist()
+             if counts[s] > 0 or (c.categorical and s < len(c.levels))]
+    shown.sort(key=lambda s: -counts[s])        # stable → ties keep order
+    keys = [c.levels[s] if s < len(c.levels) else np.nan for s in shown]
+    values = counts[shown]
+    return dict(zip(keys, _scale(values, n, normalize)))
+
+
+def k_way(coded: List[Coded], table, n: int, normalize: bool) -> Dict[Any, int | float]:
+    """``groupby(cols).size()`` as a dict: observed, sorted, no missing."""
+    if isinstance(table, np.ndarray):
+        table = table[tuple(slice(0, len(c.levels)) for c in coded)]
+        idx = np.nonzero(table)
+        counts = table[idx]
+    else:
+        rows, counts = table
+        ok = np.all(rows < [len(c.levels) for c in coded], axis=1)
+        idx, counts = tuple(rows[ok].T), counts[ok]
+
+    columns = [c.levels[i].tolist() for c, i in zip(coded, idx)]
+    keys = columns[0] if len(coded) == 1 else list(zip(*columns))
+    return dict(zip(keys, _scale(counts, n, normalize)))
+
+
+def all_crossings(
+    columns: List[str],
+    crossings: Iterable[Tuple[str, ...]] | None,
+) -> List[Tuple[str, ...]]:
+    """Explicit *crossings*, or every combination of ≥ 2 *columns*."""
+    if crossings is None:
+        # all non-empty combinations, size ≥ 2
+        return [
+            comb for r in range(2, len(columns) + 1)
+            for comb in combinations(columns, r)
+        ]
+    return [tuple(cross) for cross in crossings]   # hashable / canonical
+
+
+def count_all(
+    df,
+    columns: List[str],
+    all_cross: List[Tuple[str, ...]],
+    *,
+    backend: str | Backend | None = None,
+) -> Tuple[int, Dict[str, Coded], Dict[str, np.ndarray], Dict[Tuple[str, ...], Any]]:
+    """
+    Code every column of *df* (any table a *backend* reads, see
+    :func:`resolve_backend`) once and count it and every crossing.
 
+    Returns the number of rows, the coded columns, per-slot counts of
+    each column and the :func:`count_table` of each crossing.
+    """
+    names = list(dict.fromkeys(columns + [c for cross in all_cross for c in cross]))
+    backend, df = resolve_backend(df, backend)
+    df = backend.select(df, names)
+    n = backend.rows(df)
+    coded = {c: code_values(backend, df, c) for c in names}
+    axis = {c: i for i, c in enumerate(names)}
+
+    # dense tables by axis set, largest crossings first so that smaller
+    # ones can be summed out of them
+    dense: Dict[frozenset, Tuple[Tuple[int, ...], np.ndarray]] = {}
+
+    def table_for(cols: Tuple[str, ...]):
+        keep = tuple(axis[c] for c in cols)
+        want = frozenset(keep)
+        best = min((t for k, t in dense.items() if want <= k),
+                   key=lambda t: t[1].size, default=None)
+        if best is not None and best[1].size <= max(n, 1):
+            return marginal(best[1], best[0], keep)
+        table = count_table([coded[c] for c in cols])
+        if isinstance(table, np.ndarray) and table.size <= max(n, 1):
+            dense[want] = (keep, table)
+        return table
+
+    k_tables = {cross: table_for(cross)
+                for cross in sorted(set(all_cross), key=len, reverse=True)}
+
+    one = {}
+    for c in columns:
+        counts = table_for((c,))
+        if not isinstance(counts, np.ndarray):
+            counts = np.bincount(coded[c].slots, minlength=coded[c].size)
+        one[c] = counts
+    return n, coded, one, k_tables
 
+
+# ════════════════════════════════════════════════════════════════════
+# report
+# ════════════════════════════════════════════════════════════════════
 def report(
     df: pd.DataFrame,
     columns: Iterable[str],
     *,
     crossings: Iterable[Tuple[str, ...]] | None = None,
     normalize: bool = False,
+    backend: str | Backend | None = None,
 ) -> Dict[str | Tuple[str, ...], Mapping[Any, int | float]]:
     """
     Return observed frequencies for…
@@ -19,7 +233,8 @@ def report(
     Parameters
     ----------
     df : DataFrame
-        Your data.
+        Your data: a pandas or polars (also lazy) frame, or a dict of
+        column arrays.
     columns : iterable of str
         Columns to analyse.  Order doesn’t matter.
     crossings : iterable of tuple[str, ...] | None, default None
@@ -27,40 +242,230 @@ def report(
         Otherwise supply explicit tuples, e.g.  [("color", "shape"), ("subject",)].
     normalize : bool, default False
         If True, return proportions instead of raw counts.
+    backend : {"pandas", "polars", "numpy"}, optional
+        Table type to read *df* with (default: the one of *df*); see
+        :func:`resolve_backend`.  The counts do not depend on it.  Only
+        the listed columns are read; missing values are reported as
+        NaN with every backend.
 
     Returns
     -------
     dict
         Keys are column names (str) or column-tuples for crossings.
         Values are Counters:  {level_or_tuple: count | proportion}.
+
+    Every column is factorized to integer codes once; each crossing is
+    counted with mixed-radix keys and ``np.bincount``, and lower-order
+    tables are summed out of higher-order ones where one is at hand.
+    The result is the same as ``value_counts(dropna=False)`` per column
+    and ``groupby(list(cross)).size()`` per crossing.
+
+    Examples:
+        >>> df = pd.DataFrame({"color": ["red", "red", "blue"],
+        ...                    "word": ["red", "blue", "blue"]})
+        >>> report(df, ["color", "word"])
+        {'color': {'red': 2, 'blue': 1}, 'word': {'blue': 2, 'red': 1}, ('color', 'word'): {('blue', 'blue'): 1, ('red', 'blue'): 1, ('red', 'red'): 1}}
+        >>> log = pd.DataFrame({"rep": pd.Series([None, "y", "y"], dtype=object)})
+        >>> report(log, ["rep"]), report(log, ["rep"], backend="numpy")
+        ({'rep': {'y': 2, nan: 1}}, {'rep': {'y': 2, nan: 1}})
     """
     columns = list(columns)
+    all_cross = all_crossings(columns, crossings)
+    n, coded, one, k_tables = count_all(df, columns, all_cross, backend=backend)
     report: Dict[str | Tuple[str, ...], Mapping[Any, int | float]] = {}
 
     # 1-way frequencies
     for c in columns:
-        vc = df[c].value_counts(normalize=normalize, dropna=False)
-        report[c] = vc.to_dict()
-
-    # decide which crossings to compute
-    if crossings is None:
-        # all non-empty combinations, size ≥ 2
-        all_cross = (
-            comb for r in range(2, len(columns) + 1)
-            for comb in combinations(columns, r)
-        )
-    else:
-        all_cross = crossings
+        report[c] = one_way(coded[c], one[c], n, normalize)
 
     # k-way frequencies
     for cross in all_cross:
-        cross = tuple(cross)            # make hashable / canonical
-        vc = (
-            df
-            .groupby(list(cross))
-            .size()
-            .pipe(lambda s: s / len(df) if normalize else s)
-        )
-        report[cross] = vc.to_dict()
+        report[cross] = k_way([coded[c] for c in cross], k_tables[cross],
+                              n, normalize)
 
     return report
+
+
+# ════════════════════════════════════════════════════════════════════
+# mergeable reports over many files / growing logs
+# ════════════════════════════════════════════════════════════════════
+_FORMAT = 1                     # version of the to_bytes layout
+
+
+class ReportAccumulator:
+    """
+    :func:`report` built up chunk by chunk.
+
+    Keeps sparse count tables (only observed levels) for each column and
+    crossing; :meth:`update` adds a chunk, :meth:`merge` adds another
+    accumulator's counts, and :meth:`result` returns exactly what
+    ``report`` would give on all the rows concatenated, in the order
+    they were added.  :meth:`to_bytes` / :meth:`from_bytes` store the
+    counts compactly (zlib-compressed JSON), so levels must be JSON
+    values – strings, numbers or booleans.
+
+    Examples:
+        >>> acc = ReportAccumulator(["color", "word"])
+        >>> acc.update(pd.DataFrame({"color": ["red", "red"], "word": ["red", "blue"]}))
+        >>> other = ReportAccumulator(["color", "word"])
+        >>> other.update(pd.DataFrame({"color": ["blue"], "word": ["blue"]}))
+        >>> acc.merge(other)
+        >>> acc.n
+        3
+        >>> acc.result()[("color", "word")]
+        {('blue', 'blue'): 1, ('red', 'blue'): 1, ('red', 'red'): 1}
+        >>> ReportAccumulator.from_bytes(acc.to_bytes()).result(normalize=True)["word"]
+        {'blue': 0.6666666666666666, 'red': 0.3333333333333333}
+    """
+
+    def __init__(
+        self,
+        columns: Iterable[str],
+        *,
+        crossings: Iterable[Tuple[str, ...]] | None = None,
+    ):
+        self.columns = list(columns)
+        self.crossings = all_crossings(self.columns, crossings)
+        self.n = 0
+        # missing values are counted under the key None
+        self.counts: Dict[str, Dict[Any, int]] = {c: {} for c in self.columns}
+        self.cross: Dict[Tuple[str, ...], Dict[Any, int]] = {x: {} for x in self.crossings}
+        self.categories: Dict[str, List] = {}       # Categorical columns
+
+    # ------------------------------------------------------------------
+    def update(self, df, *, backend: str | Backend | None = None) -> None:
+        """Count the rows of *df* (after all rows seen so far)."""
+        n, coded, one, k_tables = count_all(df, self.columns, self.crossings,
+                                            backend=backend)
+        for c, col in coded.items():                # crossings' columns too
+            if col.categorical:
+                self._categories(c, col.levels.tolist())
+        for c in self.columns:
+            col, table = coded[c], self.counts[c]
+            for s in col.tie.tolist():              # first-appearance order
+                if one[c][s]:
+                    key = col.levels[s] if s < len(col.levels) else None
+                    table[key] = table.get(key, 0) + int(one[c][s])
+
+        for cross in dict.fromkeys(self.crossings):
+            part = k_way([coded[c] for c in cross], k_tables[cross], n, False)
+            table = self.cross[cross]
+            for key, count in part.items():
+                table[key] = table.get(key, 0) + count
+        self.n += n
+
+    def merge(self, other: "ReportAccumulator") -> None:
+        """Add the counts of *other*, whose rows come after this one's."""
+        if other.columns != self.columns or other.crossings != self.crossings:
+            raise ValueError("Cannot merge reports over different columns or crossings")
+        for mine, theirs in [*zip(self.counts.values(), other.counts.values()),
+                             *zip(self.cross.values(), other.cross.values())]:
+            for key, count in theirs.items():
+                mine[key] = mine.get(key, 0) + count
+        for c, cats in other.categories.items():
+            self._categories(c, cats)
+        self.n += other.n
+
+    def _categories(self, c: str, cats: List) -> None:
+        known = self.categories.setdefault(c, [])
+        known += [v for v in cats if v not in known]
+
+    # ------------------------------------------------------------------
+    def result(self, normalize: bool = False) -> Dict[str | Tuple[str, ...], Mapping[Any, int | float]]:
+        """The :func:`report` of everything counted so far."""
+        def scale(table: Dict[Any, int]) -> Dict[Any, int | float]:
+            if not normalize:
+                return dict(table)
+            return {k: v / self.n if self.n else np.nan for k, v in table.items()}
+
+        report: Dict[str | Tuple[str, ...], Mapping[Any, int | float]] = {}
+        for c in self.columns:
+            table = self.counts[c]
+            if c in self.categories:                # unobserved levels too
+                table = {**{v: table.get(v, 0) for v in self.categories[c]},
+                         **({None: table[None]} if None in table else {})}
+            items = sorted(table.items(), key=lambda kv: -kv[1])
+            report[c] = scale({(np.nan if k is None else k): v for k, v in items})
+
+        for cross in self.crossings:
+            report[cross] = scale(dict(self._sorted(cross)))
+        return report
+
+    def _sorted(self, cross: Tuple[str, ...]) -> List[Tuple[Any, int]]:
+        """Crossing counts in ``groupby`` order (category order for Categoricals)."""
+        rank = [{v: i for i, v in enumerate(self.categories[c])} if c in self.categories
+                else None for c in cross]
+
+        def key(kv):
+            levels = kv[0] if len(cross) > 1 else (kv[0],)
+            return tuple(v if r is None else r[v] for v, r in zip(levels, rank))
+
+        items = list(self.cross[cross].items())
+        try:
+            return sorted(items, key=key)
+        except TypeError:                           # unorderable mix of types
+            return items
+
+    # ------------------------------------------------------------------
+    def to_bytes(self) -> bytes:
+        """Compact serialized counts; see :meth:`from_bytes`."""
+        state = {
+            "format": _FORMAT,
+            "columns": self.columns,
+            "crossings": self.crossings,
+            "n": self.n,
+            "counts": [list(t.items()) for t in self.counts.values()],
+            "cross": [list(t.items()) for t in self.cross.values()],
+            "categories": self.categories,
+        }
+        return zlib.compress(json.dumps(state, separators=(",", ":")).encode())
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "ReportAccumulator":
+        """Restore an accumulator saved with :meth:`to_bytes`."""
+        state = json.loads(zlib.decompress(data))
+        if state.get("format") != _FORMAT:
+            raise ValueError(f"Unsupported report format {state.get('format')!r}")
+        acc = cls(state["columns"], crossings=[tuple(x) for x in state["crossings"]])
+        acc.n = state["n"]
+        for c, items in zip(acc.columns, state["counts"]):
+            acc.counts[c] = {k: v for k, v in items}
+        for cross, items in zip(acc.cross, state["cross"]):
+            acc.cross[cross] = {(tuple(k) if len(cross) > 1 else k): v for k, v in items}
+        acc.categories = state["categories"]
+        return acc
+
+
+def report_dataset(
+    source: Source,
+    columns: Iterable[str],
+    *,
+    crossings: Iterable[Tuple[str, ...]] | None = None,
+    normalize: bool = False,
+    filters: Filters = None,
+    format: str | None = None,
+    batch_size: int = 1 << 20,
+) -> Dict[str | Tuple[str, ...], Mapping[Any, int | float]]:
+    """
+    :func:`report` of a Parquet / Arrow file or dataset (see
+    :func:`open_dataset`), reading only *columns*, only the rows
+    *filters* keeps, *batch_size* rows at a time into a
+    :class:`ReportAccumulator`.
+
+    Examples:
+        >>> import tempfile
+        >>> path = tempfile.mkdtemp() + "/log.parquet"
+        >>> pd.DataFrame({"subject": [1, 1, 2], "rt": [410, 380, 520],
+        ...               "color": ["red", "blue", "blue"]}).to_parquet(path)
+        >>> report_dataset(path, ["color"], filters=[("subject", "==", 1)])
+        {'color': {'red': 1, 'blue': 1}}
+        >>> report_dataset(path, ["color"], crossings=[("subject", "color")])[("subject", "color")]
+        {(1, 'blue'): 1, (1, 'red'): 1, (2, 'blue'): 1}
+    """
+    acc = ReportAccumulator(columns, crossings=crossings)
+    read = list(dict.fromkeys(acc.columns + [c for cross in acc.crossings for c in cross]))
+    dataset = open_dataset(source, format=format)
+    for batch in dataset.to_batches(columns=read, filter=scan_filter(filters),
+                                    batch_size=batch_size):
+        acc.update(batch.to_pandas())
+    return acc.result(normalize)